@@ -29,6 +29,9 @@ setuptools.setup(
         'pandas',
         'matplotlib'
     ],
+    extras_require={
+        'arrow': ['pyarrow']
+    },
     entry_points='''
         [console_scripts]
         pbdg=pbdg.main:main
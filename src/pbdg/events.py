@@ -1,49 +1,263 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
 
+import os
 from os.path import exists
-import uuid
+import glob
+import tempfile
+import multiprocessing
 from datetime import datetime
+from enum import Enum, auto
+import numpy as np
 import pandas as pd
 from pbdg.options import *
+from pbdg.storage import StorageFormat, IdFormat, EventsWriter, import_pyarrow, read_events, storage_path
 
 
-class PlayerEvent:
-    """A player event class. It represents an event generated by a player during a game session."""
+class GameEngine(Enum):
+    serial = auto()
+    vectorized = auto()
+    scheduled = auto()
 
-    def __init__(self, cohort_id, platform_type, player_id, player_type, session_id, event_type, timestamp, payload={}):
-        self.id = uuid.uuid4()
-        self.platform_type = platform_type
-        self.cohort_id = cohort_id
-        self.player_id = player_id
-        self.player_type = player_type
-        self.session_id = session_id
-        self.event_type = event_type
-        self.timestamp = timestamp
-        self.payload = payload
-
-    def to_dict(self):
-        return {
-            PlayerEventField.id.name: [self.id.hex],
-            PlayerEventField.platform_type.name: [self.platform_type],
-            PlayerEventField.cohort_id.name: [self.cohort_id.hex],
-            PlayerEventField.player_id.name: [self.player_id.hex],
-            PlayerEventField.player_type.name: [self.player_type],
-            PlayerEventField.session_id.name: [self.session_id.hex],
-            PlayerEventField.event_type.name: [self.event_type.name],
-            PlayerEventField.timestamp.name: [self.timestamp.isoformat()],
-            **self.payload
+    @classmethod
+    def names(cls):
+        return list(map(lambda e: e.name, cls))
+
+
+PLATFORM_TYPES = WeightedDictionary({
+    PlatformType.PLAYSTATION_5.name: 0.1,
+    PlatformType.MICROSOFT_XBOX_ONE.name: 0.3,
+    PlatformType.NINTENDO_SWITCH.name: 0.5,
+    PlatformType.ANDROID.name: 0.7,
+    PlatformType.IOS.name: 1.0,
+})
+
+
+ID_PLAYER_BITS = 24
+ID_COUNTER_BITS = 24
+
+
+def check_id_field(values, bits, name):
+    """Raise a ValueError when a value does not fit in the bits of its id field, it would overflow into the next one."""
+    if np.max(values, initial=0) >= 1 << bits:
+        raise ValueError(f'there are at most {1 << bits} {name}, their ids field has {bits} bits')
+
+
+def player_int_id(day, player):
+    """Return the 64-bit id of the player at index player of the cohort acquired on day (scalars or arrays)."""
+    check_id_field(player, ID_PLAYER_BITS, 'players per day')
+    return (day << ID_PLAYER_BITS) | player
+
+
+def counter_int_id(player_id, counter):
+    """Return the 64-bit id numbering a session or an event of a player (scalars or arrays)."""
+    check_id_field(counter, ID_COUNTER_BITS, 'sessions or events per player')
+    return (player_id << ID_COUNTER_BITS) | counter
+
+
+class PlayerCounterIds:
+    """The ids numbering the sessions or the events of a player, one after the other or by consecutive ranges."""
+
+    def __init__(self, player_id):
+        self.player_id = player_id << ID_COUNTER_BITS
+        self.counter = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.take(1)
+
+    def take(self, count):
+        """Return the first of count consecutive ids and advance past them."""
+        counter = self.counter
+        self.counter += count
+        if self.counter > 1 << ID_COUNTER_BITS:
+            check_id_field(self.counter - 1, ID_COUNTER_BITS, 'sessions or events per player')
+        return self.player_id | counter
+
+
+def player_counters(players, counters):
+    """Number the items of each player in order, following the players counters, and advance the counters."""
+    order = np.argsort(players, kind='stable')
+    sorted_players = players[order]
+    ranks = np.empty(len(players), dtype=np.int64)
+    ranks[order] = np.arange(len(players)) - np.searchsorted(sorted_players, sorted_players, side='left')
+    numbers = counters[players] + ranks
+    counters += np.bincount(players, minlength=len(counters))
+    return numbers
+
+
+EPOCH = datetime(1970, 1, 1)
+ONE_MICROSECOND = timedelta(microseconds=1)
+
+
+def epoch_ns(timestamp):
+    """Return the int64 nanoseconds since epoch of a naive datetime, the value stored in the datetime64[ns] columns."""
+    return (timestamp - EPOCH) // ONE_MICROSECOND * 1000
+
+
+def players_seed_sequence(seed, day, player):
+    """Return the random stream of a player of the cohort acquired on day, or of a block of players starting with it.
+
+    The streams are the children of SeedSequence(seed).spawn(days)[day], created directly from their spawn key so they
+    do not depend on the order in which the cohorts and players are simulated or on how they are split between workers.
+    """
+    return np.random.SeedSequence(seed, spawn_key=(day, player))
+
+
+def events_payload_fields(stages=False):
+    """Return the events payload fields, the stage fields being only generated with the stage events."""
+    return ([PlayerEventField.stage_id, PlayerEventField.stage_score] if stages else []) + [PlayerEventField.item_value]
+
+
+class PlayerEventBuffer:
+    """A columnar player events buffer. Events are appended field by field into growable columns and turned into a single DataFrame on flush.
+
+    The timestamps are int64 nanoseconds since epoch (or datetime64[ns] arrays when extending) and become a datetime64[ns] column.
+    """
+
+    FIELDS = [
+        PlayerEventField.id,
+        PlayerEventField.platform_type,
+        PlayerEventField.cohort_id,
+        PlayerEventField.player_id,
+        PlayerEventField.player_type,
+        PlayerEventField.session_id,
+        PlayerEventField.event_type,
+        PlayerEventField.timestamp
+    ]
+
+    DTYPES = {
+        PlayerEventField.id: 'int64',
+        PlayerEventField.cohort_id: 'int64',
+        PlayerEventField.player_id: 'int64',
+        PlayerEventField.session_id: 'int64',
+        PlayerEventField.timestamp: 'datetime64[ns]',
+        PlayerEventField.item_value: 'float64'
+    }
+
+    # the stage fields are only set on the stage events, they are nullable integer columns
+    NULLABLE_DTYPES = {
+        PlayerEventField.stage_id: 'Int64',
+        PlayerEventField.stage_score: 'Int32'
+    }
+
+    CATEGORIES = {
+        PlayerEventField.platform_type: PlatformType.names(),
+        PlayerEventField.event_type: PlayerEventType.names()
+    }
+
+    def __init__(self, payload_fields=[PlayerEventField.item_value], player_types=[]):
+        self.payload_fields = list(payload_fields)
+        self.fields = PlayerEventBuffer.FIELDS + self.payload_fields
+        self.categories = {**PlayerEventBuffer.CATEGORIES, PlayerEventField.player_type: list(player_types)}
+        self.categorical_dtypes = {field: pd.CategoricalDtype(categories) for field, categories in self.categories.items()}
+        self.codes = {
+            field: {name: code for code, name in enumerate(categories)}
+            for field, categories in self.categories.items()
+        }
+        self.platform_type_codes = self.codes[PlayerEventField.platform_type]
+        self.player_type_codes = self.codes[PlayerEventField.player_type]
+        self.event_type_codes = self.codes[PlayerEventField.event_type]
+        self.payload_names = [field.name for field in self.payload_fields]
+        self.clear()
+
+    def __len__(self):
+        return len(self.columns[PlayerEventField.id]) + sum(len(chunk[PlayerEventField.id]) for chunk in self.chunks)
+
+    def clear(self):
+        self.new_columns()
+        self.chunks = []
+        self.stages_sessions = []
+
+    def new_columns(self):
+        self.columns = {field: [] for field in self.fields}
+        # the columns append methods in fields order, bound once instead of looking up the columns for each event
+        self.appends = tuple(self.columns[field].append for field in self.fields)
+
+    def append(self, id, cohort_id, platform_type, player_id, player_type, session_id, event_type, timestamp, payload={}):
+        (append_id, append_platform_type, append_cohort_id, append_player_id, append_player_type, append_session_id,
+         append_event_type, append_timestamp, *append_payload) = self.appends
+        append_id(id)
+        append_platform_type(self.platform_type_codes[platform_type])
+        append_cohort_id(cohort_id)
+        append_player_id(player_id)
+        append_player_type(self.player_type_codes[player_type])
+        append_session_id(session_id)
+        append_event_type(self.event_type_codes[event_type.name])
+        append_timestamp(timestamp)
+        for name, append in zip(self.payload_names, append_payload):
+            append(payload.get(name))
+
+    def append_session_stages(self, event_ids, cohort_id, platform_type, player_id, player_type, session_id,
+                              session_begin, session_end, stage_options):
+        """Append a session whose stages are drawn later with the stages of the other sessions of the day."""
+        self.stages_sessions.append((event_ids, cohort_id, self.platform_type_codes[platform_type], player_id,
+                                     self.player_type_codes[player_type], session_id, session_begin, session_end,
+                                     stage_options))
+
+    def pop_stages_sessions(self):
+        """Return and forget the sessions appended since the last call."""
+        stages_sessions = self.stages_sessions
+        self.stages_sessions = []
+        return stages_sessions
+
+    def extend(self, id, cohort_id, platform_type, player_id, player_type, session_id, event_type, timestamp, payload):
+        """Append a batch of events, each argument being an array with one value per event (platform, player and event types as codes)."""
+        self.seal()
+        count = len(timestamp)
+        chunk = {
+            PlayerEventField.id: id,
+            PlayerEventField.platform_type: platform_type,
+            PlayerEventField.cohort_id: cohort_id,
+            PlayerEventField.player_id: player_id,
+            PlayerEventField.player_type: player_type,
+            PlayerEventField.session_id: session_id,
+            PlayerEventField.event_type: event_type,
+            PlayerEventField.timestamp: timestamp
         }
+        for field in self.payload_fields:
+            chunk[field] = payload.get(field.name, np.full(count, None))
+        self.chunks.append(chunk)
+
+    def seal(self):
+        """Move the events appended one by one into a typed chunk."""
+        if len(self.columns[PlayerEventField.id]) > 0:
+            self.chunks.append(self.columns)
+            self.new_columns()
 
     def to_dataframe(self):
-        return pd.DataFrame.from_dict(self.to_dict())
+        """Concatenate the chunks into a DataFrame, the platform, player and event types being categoricals."""
+        self.seal()
+        columns = dict()
+        for field in self.fields:
+            if field in PlayerEventBuffer.NULLABLE_DTYPES:
+                dtype = PlayerEventBuffer.NULLABLE_DTYPES[field]
+                columns[field.name] = pd.concat(
+                    [pd.Series(pd.array(chunk[field], dtype=dtype)) for chunk in self.chunks] or [pd.Series([], dtype=dtype)],
+                    ignore_index=True
+                ).array
+                continue
+            dtype = 'int8' if field in self.categories else PlayerEventBuffer.DTYPES.get(field, object)
+            values = np.concatenate(
+                [np.asarray(chunk[field], dtype=dtype) for chunk in self.chunks] or [np.empty(0, dtype=dtype)])
+            if field in self.categories:
+                values = pd.Categorical.from_codes(values, dtype=self.categorical_dtypes[field])
+            columns[field.name] = values
+        return pd.DataFrame(columns)
+
+    def flush(self):
+        dataframe = self.to_dataframe()
+        self.clear()
+        return dataframe
 
 
 class SessionActivity:
 
     def __init__(self, platform_type, cohort_id, player_id, player_type,
                  session_id, session_start_date, session_options, purchase_options,
-                 stage_options):
+                 stage_options, event_ids, rng=np.random, stages=False):
         self.platform_type = platform_type
         self.cohort_id = cohort_id
         self.player_id = player_id
@@ -53,112 +267,93 @@ class SessionActivity:
         self.session_options = session_options
         self.purchase_options = purchase_options
         self.stage_options = stage_options
-        self.events = []
+        self.event_ids = event_ids
+        self.rng = rng
+        self.stages = stages
 
-    def generate_events(self):
+    def generate_events(self, events):
 
+        rng = self.rng
         purchase_options = self.purchase_options
         # add session events
-        session_begin_datetime = self.session_start_date + self.session_options.time()
-        session_duration = self.session_options.duration()
+        session_begin_datetime = self.session_start_date + self.session_options.time(rng)
+        session_duration = self.session_options.duration(rng)
         session_end_time = session_begin_datetime + session_duration
+        session_begin_timestamp = epoch_ns(session_begin_datetime)
+        session_end_timestamp = epoch_ns(session_end_time)
 
-        self.events.append(PlayerEvent(
+        events.append(
+            next(self.event_ids),
             self.cohort_id,
             self.platform_type,
             self.player_id,
             self.player_type,
             self.session_id,
             PlayerEventType.BEGIN_SESSION,
-            session_begin_datetime
-        ))
+            session_begin_timestamp
+        )
 
-        # Generate App purchase events
-        spend_time = purchase_options.spend_count()
+        # Generate App purchase events, drawing the spends and their amounts of the session at once
+        spend_time = purchase_options.spend_count(rng)
+        must_spends = purchase_options.sample_must_spend(spend_time, rng)
+        amounts = iter(purchase_options.sample_amount(np.count_nonzero(must_spends), rng).tolist())
 
         for i in range(spend_time):
-            self.events.append(PlayerEvent(
+            events.append(
+                next(self.event_ids),
                 self.cohort_id,
                 self.platform_type,
                 self.player_id,
                 self.player_type,
                 self.session_id,
                 PlayerEventType.IAP_ITEMS_LIST,
-                session_begin_datetime
-            ))
+                session_begin_timestamp
+            )
 
-            if purchase_options.must_spend():
-                amount_per_spend = purchase_options.amount()
-                self.events.append(PlayerEvent(
+            if must_spends[i]:
+                amount_per_spend = next(amounts)
+                events.append(
+                    next(self.event_ids),
                     self.cohort_id,
                     self.platform_type,
                     self.player_id,
                     self.player_type,
                     self.session_id,
                     PlayerEventType.IAP_TRANSACTION,
-                    session_begin_datetime,
+                    session_begin_timestamp,
                     {
                         PlayerEventField.item_value.name: amount_per_spend,
                     }
-                ))
+                )
 
-        self.events.append(PlayerEvent(
+        events.append(
+            next(self.event_ids),
             self.cohort_id,
             self.platform_type,
             self.player_id,
             self.player_type,
             self.session_id,
             PlayerEventType.END_SESSION,
-            session_end_time
-        ))
+            session_end_timestamp
+        )
 
         # Generate stage events
-        # self.generate_stage_events(session_begin_datetime, session_end_time)
-
-        return pd.concat(map(PlayerEvent.to_dataframe, self.events))
-
-    def generate_stage_events(self, session_begin_datetime, session_end_time):
-        # add stages events
-        stage_options = self.stage_options
-        stage_begin_datetime = session_begin_datetime + stage_options.interval_duration()
-        stage_duration = stage_options.duration()
-        stage_end_time = stage_begin_datetime + stage_duration
-
-        while stage_end_time <= session_end_time:
-            stage_id = uuid.uuid4()
-            stage_score = stage_options.score()
-
-            self.events.append(PlayerEvent(
-                self.cohort_id,
-                self.platform_type,
-                self.player_id,
-                self.player_type,
-                self.session_id,
-                PlayerEventType.BEGIN_STAGE,
-                stage_begin_datetime,
-                {
-                    PlayerEventField.stage_id.name: stage_id
-                }
-            ))
-
-            self.events.append(PlayerEvent(
-                self.cohort_id,
-                self.platform_type,
-                self.player_id,
-                self.player_type,
-                self.session_id,
-                PlayerEventType.END_STAGE,
-                stage_end_time,
-                {
-                    PlayerEventField.stage_id.name: stage_id,
-                    PlayerEventField.stage_score.name: stage_score
-                }
-            ))
-
-            stage_begin_datetime = stage_end_time + stage_options.interval_duration()
-            stage_duration = stage_options.duration()
-            stage_end_time = stage_begin_datetime + stage_duration
+        if self.stages:
+            self.generate_stage_events(events, session_begin_timestamp, session_end_timestamp)
 
+    def generate_stage_events(self, events, session_begin_timestamp, session_end_timestamp):
+        # the stages of the session are drawn with the stages of all the sessions of the day
+        events.append_session_stages(
+            self.event_ids,
+            self.cohort_id,
+            self.platform_type,
+            self.player_id,
+            self.player_type,
+            self.session_id,
+            session_begin_timestamp,
+            session_end_timestamp,
+            self.stage_options
+        )
 
 
 class PlayerState:
@@ -169,7 +364,7 @@ class PlayerState:
 
 class PlayerActivity:
 
-    def __init__(self, cohort_id, platform_type, player_id, player_type, player_options, player_start_date, player_players_options_random):
+    def __init__(self, cohort_id, platform_type, player_id, player_type, player_options, player_start_date, player_players_options_random, rng=np.random, stages=False):
         self.cohort_id = cohort_id
         self.platform_type = platform_type
         self.player_id = player_id
@@ -179,15 +374,19 @@ class PlayerActivity:
         self.current_day = 0
         self.user_registered = False
         self.player_players_options_random = player_players_options_random
+        self.session_ids = PlayerCounterIds(player_id)
+        self.event_ids = PlayerCounterIds(player_id)
+        self.rng = rng
+        self.stages = stages
 
-    def generate_events(self):
+    def generate_events(self, events):
 
+        rng = self.rng
         lifetime_weight = self.player_options.lifetime[self.current_day]
 
         if (lifetime_weight <= 0):
-            return None
+            return False
 
-        sessions_dataframes = []
         session_date = datetime.combine(
             self.player_start_date.date() + timedelta(days=self.current_day),
             datetime.min.time()
@@ -202,23 +401,22 @@ class PlayerActivity:
 
                 weight = lifetime_weight * sessions_options[session_options]
 
-                if random.random() < weight:
-                    events = []
-                    session_id = uuid.uuid4()
-                    stage_options = self.player_options.stages_options[random.random()]
-                    purchase_options = self.player_options.purchase_options[random.random()]
+                if rng.random() < weight:
+                    session_id = next(self.session_ids)
+                    stage_options = self.player_options.stages_options[rng.random()]
+                    purchase_options = self.player_options.purchase_options[rng.random()]
 
                     if not self.user_registered:
-                        events.append(PlayerEvent(
+                        events.append(
+                            next(self.event_ids),
                             self.cohort_id,
                             self.platform_type,
                             self.player_id,
                             self.player_type,
                             session_id,
                             PlayerEventType.USER_REGISTRATION,
-                            self.player_start_date
-                        ))
-                        sessions_dataframes.append(pd.concat(map(PlayerEvent.to_dataframe, events)))
+                            epoch_ns(self.player_start_date)
+                        )
                         self.user_registered = True
 
                     session_activity = SessionActivity(
@@ -230,33 +428,85 @@ class PlayerActivity:
                         session_date,
                         session_options,
                         purchase_options,
-                        stage_options
+                        stage_options,
+                        self.event_ids,
+                        rng,
+                        self.stages
                     )
-                    sessions_dataframes.append(session_activity.generate_events())
+                    session_activity.generate_events(events)
 
         self.current_day += 1
 
-        if len(sessions_dataframes) == 0:
-            return pd.DataFrame()
-        else:
-            return pd.concat(sessions_dataframes)
+        return True
+
+
+PLAYERS_BLOCK_SIZE = 10000
+
+
+class Cohort:
+    """A cohort of players acquired the same day, or a block of it starting with the player at offset."""
+
+    def __init__(self, day, cohort_id, players, offset=0):
+        self.day = day
+        self.cohort_id = cohort_id
+        self.players = players
+        self.offset = offset
+
+
+def default_cohorts(game_options, seed):
+    return [
+        Cohort(day, day, int(game_options.players_acquisition[day][day]))
+        for day in range(game_options.simulation_days)
+    ]
+
+
+def split_cohorts(game_options, seed, block_size=PLAYERS_BLOCK_SIZE):
+    """Split the daily cohorts into blocks of players, the units of work of the events generation.
+
+    The large cohorts are split into slices of block_size players and the consecutive small cohorts (or slices) are
+    packed together, so a block is a list of cohorts of up to block_size players whose days are simulated together.
+    The blocks only depend on the acquisition curve, never on the number of workers, so that the random streams
+    attached to them produce the same events whatever the parallelism.
+    """
+    blocks = [[]]
+    players = 0
+    for cohort in default_cohorts(game_options, seed):
+        for offset in range(0, cohort.players, block_size):
+            cohort_block = Cohort(cohort.day, cohort.cohort_id, min(block_size, cohort.players - offset), offset)
+            if players + cohort_block.players > block_size and blocks[-1]:
+                blocks.append([])
+                players = 0
+            blocks[-1].append(cohort_block)
+            players += cohort_block.players
+    return [block for block in blocks if block]
 
 
 class GameActivity:
 
-    def __init__(self, game_options, start_date):
+    def __init__(self, game_options, start_date, seed, cohorts=None, stages=False):
         self.game_options = game_options
         self.start_date = start_date
-        self.current_day = 0
+        self.seed = seed
+        self.stages = stages
+        self.cohorts = cohorts if cohorts is not None else default_cohorts(game_options, seed)
+        game_options.compile()
+        self.current_day = min((cohort.day for cohort in self.cohorts), default=0)
+
+        # the players draw from their own streams, but the stages of the sessions of a day are drawn at once from a
+        # child stream of the block first player
+        first_cohort = self.cohorts[0] if self.cohorts else Cohort(0, 0, 0)
+        self.stages_rng = np.random.default_rng(
+            players_seed_sequence(seed, first_cohort.day, first_cohort.offset).spawn(1)[0])
 
-    def generate_events(self):
+    def generate_events(self, progress=True, sink=None):
 
         # update progress bar
-        print_progress_bar(self.current_day, self.game_options.simulation_days, prefix='generating events:', suffix='',
-                           length=50)
+        if progress:
+            print_progress_bar(self.current_day, self.game_options.simulation_days, prefix='generating events:', suffix='',
+                               length=50)
 
         player_activities = []
-        players_dataframes = []
+        events = PlayerEventBuffer(events_payload_fields(self.stages), self.game_options.player_types())
 
         while self.current_day < self.game_options.simulation_days:
 
@@ -267,69 +517,788 @@ class GameActivity:
             for player_activity in old_players_activities:
 
                 player_activity.player_options = self.game_options.players_options[self.current_day][player_activity.player_players_options_random]
-                player_dataframe = player_activity.generate_events()
 
-                if player_dataframe is not None:
-                    players_dataframes.append(player_dataframe)
+                if player_activity.generate_events(events):
                     player_activities.append(player_activity)
 
             # handle new players activities
-            current_new_player = int(self.game_options.players_acquisition[self.current_day][self.current_day])
-
-            # print(f'new players {current_new_player} for day {self.current_day}')
-
-            cohort_id = uuid.uuid4()
-
-            while current_new_player > 0:
-
-                player_players_options_random = random.random()
-                player_options = self.game_options.players_options[self.current_day][player_players_options_random]
-                platform_type = WeightedDictionary({
-                    PlatformType.PLAYSTATION_5.name: 0.1,
-                    PlatformType.MICROSOFT_XBOX_ONE.name: 0.3,
-                    PlatformType.NINTENDO_SWITCH.name: 0.5,
-                    PlatformType.ANDROID.name: 0.7,
-                    PlatformType.IOS.name: 1.0,
-                })[random.random()]
-
-                player_id = uuid.uuid4()
-                player_type = player_options.player_type
-                player_start_date = self.start_date + timedelta(days=self.current_day)
-
-                player_activity = PlayerActivity(
-                    cohort_id,
-                    platform_type,
-                    player_id,
-                    player_type,
-                    player_options,
-                    player_start_date,
-                    player_players_options_random
-                )
+            for cohort in self.cohorts:
 
-                player_dataframe = player_activity.generate_events()
+                if cohort.day == self.current_day:
+                    self.acquire_players(cohort, player_activities, events)
 
-                if player_dataframe is not None:
-                    players_dataframes.append(player_dataframe)
-                    player_activities.append(player_activity)
+            if self.stages:
+                self.generate_stage_events(events)
 
-                current_new_player -= 1
+            # flush the day events
+            if sink is not None and len(events) > 0:
+                sink(self.current_day, events.flush())
 
             self.current_day += 1
 
             # update progress bar
+            if progress:
+                print_progress_bar(self.current_day, self.game_options.simulation_days, prefix='generating events:',
+                                   suffix='', length=50)
+
+        return events.flush()
+
+    def generate_stage_events(self, events):
+        """Draw the stages of the sessions of the day at once and append their BEGIN_STAGE and END_STAGE events."""
+        stages_sessions = events.pop_stages_sessions()
+        if not stages_sessions:
+            return
+        (event_ids, cohort_ids, platform_types, player_ids, player_types, session_ids, session_begin, session_end,
+         stages_options) = zip(*stages_sessions)
+        session_begin = np.array(session_begin, dtype=np.int64)
+        duration_mu, duration_sigma, duration_ratio, score_mu, score_sigma = (np.array(values, dtype=float) for values in zip(*(
+            (options.duration_mu.total_seconds(), options.duration_sigma.total_seconds(), options.duration_ratio,
+             options.score_mu, options.score_sigma)
+            for options in stages_options)))
+        stages, stages_begin, stages_end = sample_stages(
+            np.array(session_end, dtype=np.int64) - session_begin, duration_mu, duration_sigma, duration_ratio,
+            self.stages_rng)
+        stages_scores = sample_count(score_mu[stages], score_sigma[stages], rng=self.stages_rng)
+
+        # each session takes the consecutive ids of its events from its player counter, a BEGIN_STAGE being followed by
+        # its END_STAGE, and a stage is identified by the id of its BEGIN_STAGE event
+        counts = np.bincount(stages, minlength=len(stages_sessions))
+        first_ids = np.array([ids.take(2 * int(count)) for ids, count in zip(event_ids, counts)], dtype=np.int64)
+        stages_ids = first_ids[stages] + 2 * (np.arange(len(stages)) - (np.cumsum(counts) - counts)[stages])
+        events_stages = np.repeat(stages, 2)
+        begins = np.arange(2 * len(stages)) % 2 == 0
+        event_types = events.codes[PlayerEventField.event_type]
+        scores = np.zeros(2 * len(stages), dtype=np.int32)
+        scores[~begins] = stages_scores
+
+        events.extend(
+            np.stack([stages_ids, stages_ids + 1], axis=1).ravel(),
+            np.array(cohort_ids, dtype=np.int64)[events_stages],
+            np.array(platform_types, dtype=np.int8)[events_stages],
+            np.array(player_ids, dtype=np.int64)[events_stages],
+            np.array(player_types, dtype=np.int8)[events_stages],
+            np.array(session_ids, dtype=np.int64)[events_stages],
+            np.tile(np.array([event_types[PlayerEventType.BEGIN_STAGE.name], event_types[PlayerEventType.END_STAGE.name]],
+                             dtype=np.int8), len(stages)),
+            (session_begin[events_stages] + np.stack([stages_begin, stages_end], axis=1).ravel()).view('datetime64[ns]'),
+            {
+                PlayerEventField.stage_id.name: pd.arrays.IntegerArray(
+                    np.repeat(stages_ids, 2), np.zeros(2 * len(stages), dtype=bool)),
+                PlayerEventField.stage_score.name: pd.arrays.IntegerArray(scores, begins),
+                PlayerEventField.item_value.name: np.full(2 * len(stages), np.nan)
+            }
+        )
 
-            print_progress_bar(self.current_day, self.game_options.simulation_days, prefix='generating events:',
-                               suffix='', length=50)
+    def acquire_players(self, cohort, player_activities, events):
+
+        cohort_id = cohort.cohort_id
+
+        for player in range(cohort.offset, cohort.offset + cohort.players):
+
+            rng = np.random.default_rng(players_seed_sequence(self.seed, cohort.day, player))
+            player_players_options_random = rng.random()
+            player_options = self.game_options.players_options[self.current_day][player_players_options_random]
+            platform_type = PLATFORM_TYPES[rng.random()]
+
+            player_id = player_int_id(cohort.day, player)
+            player_type = player_options.player_type
+            player_start_date = self.start_date + timedelta(days=self.current_day)
+
+            player_activity = PlayerActivity(
+                cohort_id,
+                platform_type,
+                player_id,
+                player_type,
+                player_options,
+                player_start_date,
+                player_players_options_random,
+                rng,
+                self.stages
+            )
+
+            if player_activity.generate_events(events):
+                player_activities.append(player_activity)
+
+
+def seconds_to_timedelta64(seconds):
+    """Convert an array of seconds into timedelta64[ns] values rounded to the microsecond like timedelta does."""
+    return (np.round(np.asarray(seconds) * 1e6).astype(np.int64) * 1000).astype('timedelta64[ns]')
+
+
+def sample_stages(sessions_duration, duration_mu, duration_sigma, duration_ratio, rng=np.random, factor=2):
+    """Draw the stages of a batch of sessions at once, returning the session index, begin and end of each stage.
+
+    The sessions durations and the stages begins and ends are in nanoseconds since the session begin, the durations
+    parameters in seconds. Each stage follows an interval after the previous stage end, so the stages ends are the
+    cumulative sums of the sampled intervals and durations, and a session stops at its first stage ending after the
+    session end. The sessions draw a batch of stages sized on their expected count, and draw again the few times all
+    their stages end before the session end.
+    """
+    sessions_duration = np.asarray(sessions_duration, dtype=np.int64)
+    duration_mu = np.broadcast_to(np.asarray(duration_mu, dtype=float), sessions_duration.shape)
+    duration_sigma = np.broadcast_to(np.asarray(duration_sigma, dtype=float), sessions_duration.shape)
+    duration_ratio = np.broadcast_to(np.asarray(duration_ratio, dtype=float), sessions_duration.shape)
+    step_mean = np.maximum((1 + duration_ratio) * duration_mu * 1e9, 1e9)
+
+    offsets = np.zeros(len(sessions_duration), dtype=np.int64)
+    pending = np.arange(len(sessions_duration))
+    stages = []
+    while len(pending) > 0:
+        remaining = np.maximum(sessions_duration[pending] - offsets[pending], 0)
+        counts = (1.25 * remaining / step_mean[pending]).astype(np.int64) + 1
+        batch = np.repeat(pending, counts)
+        intervals = seconds_to_timedelta64(duration_ratio[batch] * sample_gauss_clamp(
+            duration_mu[batch], duration_sigma[batch], factor, rng=rng)).view(np.int64)
+        durations = seconds_to_timedelta64(sample_gauss_clamp(
+            duration_mu[batch], duration_sigma[batch], factor, rng=rng)).view(np.int64)
+
+        # segmented cumulative sums of the stages steps and of the stages ending after the session end
+        starts = np.cumsum(counts) - counts
+        steps = intervals + durations
+        cumulative = np.cumsum(steps)
+        ends = offsets[batch] + cumulative - np.repeat(cumulative[starts] - steps[starts], counts)
+        over = (ends > sessions_duration[batch]).astype(np.int64)
+        cumulative = np.cumsum(over)
+        stopped = cumulative - np.repeat(cumulative[starts] - over[starts], counts) > 0
+
+        stages.append((batch[~stopped], ends[~stopped] - durations[~stopped], ends[~stopped]))
+        lasts = starts + counts - 1
+        more = ~stopped[lasts]
+        offsets[pending[more]] = ends[lasts[more]]
+        pending = pending[more]
+
+    stages_sessions, stages_begin, stages_end = (
+        np.concatenate([stage[i] for stage in stages] or [np.empty(0, dtype=np.int64)]) for i in range(3))
+    order = np.argsort(stages_sessions, kind='stable')
+    return stages_sessions[order], stages_begin[order], stages_end[order]
+
+
+class VectorizedGameActivity:
+    """A game activity simulating all the players of its cohorts at once.
+
+    The active players are kept in NumPy arrays and each simulated day draws the session, purchase and IAP
+    decisions of every player with batched numpy.random.Generator calls, following the same distributions as
+    the GameActivity, PlayerActivity and SessionActivity classes.
+    """
+
+    def __init__(self, game_options, start_date, rng, cohorts, stages=False):
+        self.game_options = game_options
+        self.start_date = start_date
+        self.rng = rng
+        self.cohorts = cohorts
+        self.stages = stages
+        self.current_day = min((cohort.day for cohort in self.cohorts), default=0)
+        self.cohort_ids = []
+        game_options.compile()
+        self.players = {
+            'options_random': np.empty(0),
+            'player_type': np.empty(0, dtype=np.int64),
+            'platform_type': np.empty(0, dtype=np.int64),
+            'start_day': np.empty(0, dtype=np.int64),
+            'registered': np.empty(0, dtype=bool),
+            'cohort': np.empty(0, dtype=np.int64),
+            'id': np.empty(0, dtype=np.int64),
+            'sessions': np.empty(0, dtype=np.int64),
+            'events': np.empty(0, dtype=np.int64)
+        }
+        self.compile_options()
+
+    def compile_options(self):
+        """Flatten the game options into arrays indexed by players, sessions and purchase options indices."""
+        self.players_options = []
+        self.days_players_options = []
+        for players_options in self.game_options.players_options:
+            indices = []
+            for player_options in players_options.keys:
+                if player_options not in self.players_options:
+                    self.players_options.append(player_options)
+                indices.append(self.players_options.index(player_options))
+            self.days_players_options.append(np.array(indices))
+
+        # the player and platform types as codes of the events buffer categories
+        player_types = self.game_options.player_types()
+        self.player_types = np.array([player_types.index(o.player_type) for o in self.players_options], dtype=np.int8)
+        self.platform_types = np.array([PlatformType.names().index(name) for name in PLATFORM_TYPES.keys], dtype=np.int8)
+
+        sessions_options = []
+        purchases_options = []
+        stages_options = []
+        self.sessions_slots = []
+        self.purchases_indices = []
+        self.stages_indices = []
+        for player_options in self.players_options:
+            slots = dict()
+            for weekday, weekday_sessions_options in player_options.sessions_options.items():
+                slots[weekday] = []
+                for session_options, probability in weekday_sessions_options.items():
+                    if session_options not in sessions_options:
+                        sessions_options.append(session_options)
+                    slots[weekday].append((sessions_options.index(session_options), probability))
+            self.sessions_slots.append(slots)
+
+            indices = []
+            for purchase_options in player_options.purchase_options.keys:
+                if purchase_options not in purchases_options:
+                    purchases_options.append(purchase_options)
+                indices.append(purchases_options.index(purchase_options))
+            self.purchases_indices.append(np.array(indices))
+
+            indices = []
+            for stage_options in player_options.stages_options.keys:
+                if stage_options not in stages_options:
+                    stages_options.append(stage_options)
+                indices.append(stages_options.index(stage_options))
+            self.stages_indices.append(np.array(indices))
+
+        self.session_time_mu = np.array([o.time_mu.total_seconds() for o in sessions_options])
+        self.session_time_sigma = np.array([o.time_sigma.total_seconds() for o in sessions_options])
+        self.session_duration_mu = np.array([o.duration_mu.total_seconds() for o in sessions_options])
+        self.session_duration_sigma = np.array([o.duration_sigma.total_seconds() for o in sessions_options])
+
+        self.amount_per_spend = np.array([o.amount_per_spend for o in purchases_options], dtype=float)
+        self.amount_per_spend_sigma = np.array([o.amount_per_spend_sigma for o in purchases_options], dtype=float)
+        self.spend_time_per_session = np.array([o.spend_time_per_session for o in purchases_options], dtype=float)
+        self.spend_time_per_session_sigma = np.array([o.spend_time_per_session_sigma for o in purchases_options], dtype=float)
+        self.spend_per_visit_ratio = np.array([o.spend_per_visit_ratio for o in purchases_options], dtype=float)
+
+        self.stage_duration_mu = np.array([o.duration_mu.total_seconds() for o in stages_options])
+        self.stage_duration_sigma = np.array([o.duration_sigma.total_seconds() for o in stages_options])
+        self.stage_duration_ratio = np.array([o.duration_ratio for o in stages_options], dtype=float)
+        self.stage_score_mu = np.array([o.score_mu for o in stages_options], dtype=float)
+        self.stage_score_sigma = np.array([o.score_sigma for o in stages_options], dtype=float)
+
+    def players_options_indices(self, options_random):
+        day = self.current_day
+        return self.days_players_options[day][self.game_options.players_options[day].sample(options_random)]
+
+    def acquire_players(self, cohort):
+        rng = self.rng
+        count = cohort.players
+        options_random = rng.random(count)
+
+        self.cohort_ids.append(cohort.cohort_id)
+        new_players = {
+            'options_random': options_random,
+            'player_type': self.players_options_indices(options_random),
+            'platform_type': PLATFORM_TYPES.sample(rng.random(count)),
+            'start_day': np.full(count, self.current_day),
+            'registered': np.zeros(count, dtype=bool),
+            'cohort': np.full(count, len(self.cohort_ids) - 1),
+            'id': player_int_id(cohort.day, np.arange(cohort.offset, cohort.offset + count, dtype=np.int64)),
+            'sessions': np.zeros(count, dtype=np.int64),
+            'events': np.zeros(count, dtype=np.int64)
+        }
+        for name in self.players:
+            self.players[name] = np.concatenate([self.players[name], new_players[name]])
+
+    def remove_players(self, alive):
+        for name in self.players:
+            self.players[name] = self.players[name][alive]
+
+    def generate_day_events(self, events):
+        rng = self.rng
+        players = self.players
+
+        # resolve players options and lifetime weights, dropping the players who reached the end of their lifetime
+        options_indices = self.players_options_indices(players['options_random'])
+        lifetime_days = self.current_day - players['start_day']
+        lifetime_weights = np.zeros(len(options_indices))
+        for options_index, player_options in enumerate(self.players_options):
+            mask = options_indices == options_index
+            lifetime_weights[mask] = player_options.lifetime[lifetime_days[mask]]
+
+        alive = lifetime_weights > 0
+        self.remove_players(alive)
+        options_indices = options_indices[alive]
+        lifetime_weights = lifetime_weights[alive]
+
+        session_date = datetime.combine(self.start_date.date() + timedelta(days=self.current_day), datetime.min.time())
+        session_weekday = WeekDay(session_date.weekday())
 
-        return pd.concat(players_dataframes)
+        # draw sessions, slot by slot for each player options
+        sessions_players = []
+        sessions_options = []
+        for options_index, slots in enumerate(self.sessions_slots):
+            options_players = np.flatnonzero(options_indices == options_index)
+            for session_options_index, probability in slots.get(session_weekday, []):
+                played = rng.random(len(options_players)) < lifetime_weights[options_players] * probability
+                sessions_players.append(options_players[played])
+                sessions_options.append(np.full(np.count_nonzero(played), session_options_index))
+
+        sessions_players = np.concatenate(sessions_players or [np.empty(0, dtype=np.int64)])
+        sessions_options = np.concatenate(sessions_options or [np.empty(0, dtype=np.int64)])
+        self.generate_sessions_events(events, session_date, sessions_players, sessions_options,
+                                      options_indices[sessions_players])
+
+    def generate_sessions_events(self, events, session_date, sessions_players, sessions_options,
+                                 sessions_players_options):
+        """Draw the registration, session and IAP events of the day sessions, given by player and session options."""
+        rng = self.rng
+        players = self.players
+        sessions_count = len(sessions_players)
+        session_ids = counter_int_id(players['id'][sessions_players], player_counters(sessions_players, players['sessions']))
+
+        # register players on their first session
+        first_sessions = np.unique(sessions_players, return_index=True)[1]
+        registrations = first_sessions[~players['registered'][sessions_players[first_sessions]]]
+        players['registered'][sessions_players[registrations]] = True
+
+        # draw sessions times and durations
+        session_begin = np.datetime64(session_date, 'ns') + seconds_to_timedelta64(sample_gauss(
+            self.session_time_mu[sessions_options], self.session_time_sigma[sessions_options], rng=rng))
+        session_end = session_begin + seconds_to_timedelta64(sample_gauss_clamp(
+            self.session_duration_mu[sessions_options], self.session_duration_sigma[sessions_options], 3, rng=rng))
+
+        # draw purchase options, spends and amounts
+        purchases_options = np.empty(sessions_count, dtype=np.int64)
+        for options_index in range(len(self.players_options)):
+            mask = sessions_players_options == options_index
+            purchases_options[mask] = self.purchases_indices[options_index][
+                self.players_options[options_index].purchase_options.sample(rng.random(np.count_nonzero(mask)))]
+
+        spend_counts = sample_count(
+            self.spend_time_per_session[purchases_options],
+            self.spend_time_per_session_sigma[purchases_options], rng=rng)
+        spends = np.repeat(np.arange(sessions_count), spend_counts)
+        spends_options = purchases_options[spends]
+        transactions = np.flatnonzero(rng.random(len(spends)) < self.spend_per_visit_ratio[spends_options])
+        amounts = sample_count(
+            self.amount_per_spend[spends_options[transactions]],
+            self.amount_per_spend_sigma[spends_options[transactions]], rng=rng)
+
+        # interleave the items list and transaction events of each spend
+        iap_order = np.argsort(np.concatenate([2 * np.arange(len(spends)), 2 * transactions + 1]), kind='stable')
+        iap_sessions = np.concatenate([spends, spends[transactions]])[iap_order]
+        event_types = events.codes[PlayerEventField.event_type]
+        iap_types = np.concatenate([
+            np.full(len(spends), event_types[PlayerEventType.IAP_ITEMS_LIST.name], dtype=np.int8),
+            np.full(len(transactions), event_types[PlayerEventType.IAP_TRANSACTION.name], dtype=np.int8)
+        ])[iap_order]
+        iap_values = np.concatenate([np.full(len(spends), np.nan), amounts])[iap_order]
+
+        # draw stage options and all the stages of the sessions
+        stages_sessions = np.empty(0, dtype=np.int64)
+        stages_begin = stages_end = np.empty(0, dtype='timedelta64[ns]')
+        if self.stages:
+            stages_options = np.empty(sessions_count, dtype=np.int64)
+            for options_index in range(len(self.players_options)):
+                mask = sessions_players_options == options_index
+                stages_options[mask] = self.stages_indices[options_index][
+                    self.players_options[options_index].stages_options.sample(rng.random(np.count_nonzero(mask)))]
+            stages_sessions, stages_begin, stages_end = sample_stages(
+                (session_end - session_begin).view(np.int64),
+                self.stage_duration_mu[stages_options],
+                self.stage_duration_sigma[stages_options],
+                self.stage_duration_ratio[stages_options],
+                rng
+            )
+            stages_options = stages_options[stages_sessions]
+            stages_scores = sample_count(self.stage_score_mu[stages_options], self.stage_score_sigma[stages_options], rng=rng)
+            stages_begin = stages_begin.astype('timedelta64[ns]')
+            stages_end = stages_end.astype('timedelta64[ns]')
+        stages_count = len(stages_sessions)
+
+        registration_players = sessions_players[registrations]
+        registration_timestamps = np.datetime64(self.start_date, 'ns') + \
+            players['start_day'][registration_players] * np.timedelta64(1, 'D')
+
+        events_sessions = np.concatenate([
+            registrations, np.arange(sessions_count), iap_sessions, np.arange(sessions_count), stages_sessions, stages_sessions])
+        events_players = sessions_players[events_sessions]
+        events_ids = counter_int_id(players['id'][events_players], player_counters(events_players, players['events']))
+        payload = {
+            PlayerEventField.item_value.name: np.concatenate([
+                np.full(len(registrations) + sessions_count, np.nan),
+                iap_values,
+                np.full(sessions_count + 2 * stages_count, np.nan)
+            ])
+        }
+
+        # a stage is identified by the id of its BEGIN_STAGE event, the stage fields are null on the other events
+        if self.stages:
+            stages_events = len(events_ids) - 2 * stages_count
+            stages_ids = np.zeros(len(events_ids), dtype=np.int64)
+            stages_ids[stages_events:] = np.tile(events_ids[stages_events:stages_events + stages_count], 2)
+            stages_scores = np.concatenate([np.zeros(len(events_ids) - stages_count, dtype=np.int32), stages_scores])
+            payload[PlayerEventField.stage_id.name] = pd.arrays.IntegerArray(
+                stages_ids, np.arange(len(events_ids)) < stages_events)
+            payload[PlayerEventField.stage_score.name] = pd.arrays.IntegerArray(
+                stages_scores.astype(np.int32), np.arange(len(events_ids)) < len(events_ids) - stages_count)
+
+        events.extend(
+            events_ids,
+            np.array(self.cohort_ids, dtype=np.int64)[players['cohort'][events_players]],
+            self.platform_types[players['platform_type'][events_players]],
+            players['id'][events_players],
+            self.player_types[players['player_type'][events_players]],
+            session_ids[events_sessions],
+            np.concatenate([
+                np.full(len(registrations), event_types[PlayerEventType.USER_REGISTRATION.name], dtype=np.int8),
+                np.full(sessions_count, event_types[PlayerEventType.BEGIN_SESSION.name], dtype=np.int8),
+                iap_types,
+                np.full(sessions_count, event_types[PlayerEventType.END_SESSION.name], dtype=np.int8),
+                np.full(stages_count, event_types[PlayerEventType.BEGIN_STAGE.name], dtype=np.int8),
+                np.full(stages_count, event_types[PlayerEventType.END_STAGE.name], dtype=np.int8)
+            ]),
+            np.concatenate([
+                registration_timestamps,
+                session_begin,
+                session_begin[iap_sessions],
+                session_end,
+                session_begin[stages_sessions] + stages_begin,
+                session_begin[stages_sessions] + stages_end
+            ]),
+            payload
+        )
 
+    def generate_events(self, progress=True, sink=None):
 
-def generate(filename, game_events_filename, date, players, days, seed, plot, overwrite, debug, hardcore, casual, churner, decay_rate, noise_scale, noise_decay_rate):
-    # set seed
+        # update progress bar
+        if progress:
+            print_progress_bar(self.current_day, self.game_options.simulation_days, prefix='generating events:', suffix='',
+                               length=50)
+
+        events = PlayerEventBuffer(events_payload_fields(self.stages), self.game_options.player_types())
+
+        while self.current_day < self.game_options.simulation_days:
+
+            for cohort in self.cohorts:
+                if cohort.day == self.current_day:
+                    self.acquire_players(cohort)
+
+            self.generate_day_events(events)
+
+            # flush the day events
+            if sink is not None and len(events) > 0:
+                sink(self.current_day, events.flush())
+
+            self.current_day += 1
+
+            # update progress bar
+            if progress:
+                print_progress_bar(self.current_day, self.game_options.simulation_days, prefix='generating events:',
+                                   suffix='', length=50)
+
+        return events.flush()
+
+
+class ScheduledGameActivity(VectorizedGameActivity):
+    """A game activity visiting each player only on the days they play.
+
+    The players sharing an acquisition day and an options class (an interval of options random values resolving to the
+    same player options on every day) share a daily activity hazard, precomputed over a calendar of the simulated days
+    up to their last possible active day. The next active day of each player is drawn from this hazard and the players
+    wait in a per-day queue, so the days without sessions and the inactive players cost nothing. On their active days,
+    the players sessions are drawn knowing that they play at least once.
+    """
+
+    def __init__(self, game_options, start_date, rng, cohorts, stages=False):
+        super().__init__(game_options, start_date, rng, cohorts, stages)
+        days = game_options.simulation_days
+        self.options_classes = np.empty(0, dtype=np.int64)
+        self.schedule = [[] for _ in range(days)]
+        self.hazards = dict()
+
+        # the calendar of the simulated days
+        self.dates = [datetime.combine(start_date.date() + timedelta(days=day), datetime.min.time()) for day in range(days)]
+        self.weekdays = [WeekDay(date.weekday()) for date in self.dates]
+        self.weekday_codes = np.array([weekday.value for weekday in self.weekdays], dtype=np.int64)
+
+        # the options classes are the intervals between the thresholds of all days players options, their options per
+        # day and the probabilities of the sessions slots of each player options per weekday
+        self.classes_thresholds = np.unique(np.concatenate(
+            [players_options.thresholds_array for players_options in game_options.players_options[:days]]))
+        classes_randoms = np.concatenate(([-1.0], self.classes_thresholds))
+        self.classes_options = np.array([
+            self.days_players_options[day][game_options.players_options[day].sample(classes_randoms)]
+            for day in range(days)
+        ]).reshape(days, len(classes_randoms)).T
+        self.slots_probabilities = np.zeros((len(self.players_options), len(WeekDay),
+                                             max([len(s) for slots in self.sessions_slots for s in slots.values()] + [0])))
+        for options_index, slots in enumerate(self.sessions_slots):
+            for weekday, weekday_slots in slots.items():
+                self.slots_probabilities[options_index, weekday.value, :len(weekday_slots)] = [p for _, p in weekday_slots]
+
+    def hazard(self, start_day, options_class):
+        """Return the cumulative activity hazards and the next certain active days of the players acquired on start_day
+        in the options class, the hazards being null from their end day, when their lifetime weight reaches zero."""
+        key = (start_day, options_class)
+        if key not in self.hazards:
+            days = self.game_options.simulation_days
+            lifetime_days = np.arange(days - start_day)
+            options_indices = self.classes_options[options_class, start_day:]
+            weights = np.zeros(len(lifetime_days))
+            for options_index in np.unique(options_indices):
+                mask = options_indices == options_index
+                weights[mask] = self.players_options[options_index].lifetime[lifetime_days[mask]]
+            end = np.flatnonzero(weights <= 0)
+            end = end[0] if len(end) > 0 else len(weights)
+
+            probabilities = np.clip(weights[:end, np.newaxis] * self.slots_probabilities[
+                options_indices[:end], self.weekday_codes[start_day:start_day + end]], 0, 1)
+            certain = np.zeros(days, dtype=bool)
+            certain[start_day:start_day + end] = np.any(probabilities >= 1, axis=1)
+            hazards = np.zeros(days)
+            with np.errstate(divide='ignore'):
+                hazards[start_day:start_day + end] = -np.sum(np.log1p(-probabilities), axis=1)
+            hazards[certain] = 0
+
+            # the first certain day from each day on, out of the simulation when there is none
+            certain_days = np.append(np.flatnonzero(certain), days)
+            next_certain = certain_days[np.searchsorted(certain_days, np.arange(days + 1))]
+            self.hazards[key] = (np.cumsum(hazards), next_certain)
+        return self.hazards[key]
+
+    def schedule_players(self, indices, day):
+        """Draw the next active day after day of the given players and queue them, dropping the players who will not
+        play anymore."""
+        exposures = self.rng.exponential(size=len(indices))
+        next_days = np.empty(len(indices), dtype=np.int64)
+        start_days = self.players['start_day'][indices]
+        options_classes = self.options_classes[indices]
+        groups = start_days * (len(self.classes_thresholds) + 1) + options_classes
+        order = np.argsort(groups, kind='stable')
+        bounds = np.concatenate(([0], np.flatnonzero(np.diff(groups[order])) + 1, [len(order)]))
+        for begin, end in zip(bounds[:-1], bounds[1:]):
+            group = order[begin:end]
+            cumulative_hazards, next_certain = self.hazard(start_days[group[0]], options_classes[group[0]])
+            base = cumulative_hazards[day] if day >= 0 else 0.0
+            drawn = np.searchsorted(cumulative_hazards, base + exposures[group], side='left')
+            next_days[group] = np.minimum(np.maximum(drawn, day + 1), next_certain[day + 1])
+
+        order = np.argsort(next_days, kind='stable')
+        next_days = next_days[order]
+        indices = indices[order]
+        bounds = np.flatnonzero(np.diff(next_days)) + 1
+        for day_indices, next_day in zip(np.split(indices, bounds), next_days[np.concatenate(([0], bounds))]):
+            if next_day < len(self.schedule):
+                self.schedule[next_day].append(day_indices)
+
+    def acquire_players(self, cohort):
+        first = len(self.players['id'])
+        super().acquire_players(cohort)
+        self.options_classes = np.searchsorted(self.classes_thresholds, self.players['options_random'], side='right')
+        self.schedule_players(np.arange(first, len(self.players['id'])), self.current_day - 1)
+
+    def generate_day_events(self, events):
+        rng = self.rng
+        players = self.players
+        day = self.current_day
+        if not self.schedule[day]:
+            return
+        active = np.sort(np.concatenate(self.schedule[day]))
+        self.schedule[day] = []
+
+        options_indices = self.players_options_indices(players['options_random'][active])
+        lifetime_days = day - players['start_day'][active]
+        lifetime_weights = np.zeros(len(active))
+        for options_index, player_options in enumerate(self.players_options):
+            mask = options_indices == options_index
+            lifetime_weights[mask] = player_options.lifetime[lifetime_days[mask]]
+
+        # draw sessions slot by slot, knowing that each player plays at least once: until a player plays, a slot is
+        # played with its probability divided by the probability that one of the remaining slots is played
+        sessions_players = []
+        sessions_options = []
+        sessions_players_options = []
+        for options_index, slots in enumerate(self.sessions_slots):
+            options_players = np.flatnonzero(options_indices == options_index)
+            day_slots = slots.get(self.weekdays[day], [])
+            if len(options_players) == 0:
+                continue
+            probabilities = np.clip(np.outer(lifetime_weights[options_players], [p for _, p in day_slots]), 0, 1)
+            remaining = 1 - np.cumprod((1 - probabilities)[:, ::-1], axis=1)[:, ::-1]
+            waiting = np.ones(len(options_players), dtype=bool)
+            for slot, (session_options_index, _) in enumerate(day_slots):
+                conditional = np.divide(probabilities[:, slot], remaining[:, slot],
+                                        out=np.ones(len(options_players)), where=remaining[:, slot] > 0)
+                played = rng.random(len(options_players)) < np.where(waiting, conditional, probabilities[:, slot])
+                waiting &= ~played
+                sessions_players.append(active[options_players[played]])
+                sessions_options.append(np.full(np.count_nonzero(played), session_options_index))
+                sessions_players_options.append(np.full(np.count_nonzero(played), options_index))
+
+        self.generate_sessions_events(
+            events,
+            self.dates[day],
+            np.concatenate(sessions_players or [np.empty(0, dtype=np.int64)]),
+            np.concatenate(sessions_options or [np.empty(0, dtype=np.int64)]),
+            np.concatenate(sessions_players_options or [np.empty(0, dtype=np.int64)])
+        )
+        self.schedule_players(active, day)
+
+
+MERGE_BUFFER_ROWS = 1000000
+
+
+def day_run_path(runs_directory, day, block):
+    return os.path.join(runs_directory, f'{day:05d}-{block:06d}.pkl')
+
+
+def generate_cohort_events(task):
+    """Simulate a block of players, each block drawing from its own random streams.
+
+    The events of each simulated day are sorted by time into a run, written in the runs directory when one is given and
+    returned as (day, run) pairs otherwise.
+    """
+    engine, game_options, start_date, seed, cohorts, block, runs_directory, stages = task
+    runs = []
+
+    def sink(day, dataframe):
+        run = dataframe.sort_values(by=[PlayerEventField.timestamp.name], kind='stable', ignore_index=True)
+        if runs_directory:
+            run.to_pickle(day_run_path(runs_directory, day, block))
+        else:
+            runs.append((day, run))
+
+    # a block draws from the stream of its first cohort
+    if engine == GameEngine.vectorized.name:
+        rng = np.random.default_rng(players_seed_sequence(seed, cohorts[0].day, cohorts[0].offset))
+        game_activity = VectorizedGameActivity(game_options, start_date, rng, cohorts, stages)
+    elif engine == GameEngine.scheduled.name:
+        rng = np.random.default_rng(players_seed_sequence(seed, cohorts[0].day, cohorts[0].offset))
+        game_activity = ScheduledGameActivity(game_options, start_date, rng, cohorts, stages)
+    else:
+        game_activity = GameActivity(game_options, start_date, seed, cohorts, stages)
+    game_activity.generate_events(progress=False, sink=sink)
+    return runs
+
+
+def generate_game_events(engine, game_options, start_date, seed, workers, runs_directory=None, stages=False):
+    """Simulate the cohorts blocks, in a process pool when there are several workers.
+
+    Without runs directory, the sorted runs of the blocks are merged in (day, block) order into the time ordered events.
+    """
+    blocks = split_cohorts(game_options, seed)
+
+    # schedule the oldest and largest blocks first as they are simulated for the most days
+    tasks = sorted(
+        range(len(blocks)),
+        key=lambda i: sum(cohort.players * (game_options.simulation_days - cohort.day) for cohort in blocks[i]),
+        reverse=True
+    )
+
+    print_progress_bar(0, len(blocks), prefix='generating events:', suffix='', length=50)
+
+    runs = [[] for _ in range(game_options.simulation_days)]
+    shards = [None] * len(blocks)
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    try:
+        results = (pool.imap if pool else map)(generate_cohort_events, (
+            (engine, game_options, start_date, seed, blocks[i], i, runs_directory, stages) for i in tasks
+        ))
+        for count, (i, shard) in enumerate(zip(tasks, results)):
+            shards[i] = shard
+            print_progress_bar(count + 1, len(blocks), prefix='generating events:', suffix='', length=50)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    if runs_directory:
+        return None
+
+    for shard in shards:
+        for day, run in shard:
+            runs[day].append(run)
+    runs = [run for day_runs in runs for run in day_runs]
+    if len(runs) == 0:
+        return PlayerEventBuffer(events_payload_fields(stages), game_options.player_types()).flush()
+    # the stable sort of sorted runs is a merge of the runs, the ties keep the runs order
+    return pd.concat(runs, ignore_index=True).sort_values(
+        by=[PlayerEventField.timestamp.name], kind='stable', ignore_index=True)
+
+
+def merge_runs(runs, key, write):
+    """Merge runs of DataFrames sorted by key into a single sorted stream, holding about a chunk per run in memory.
+
+    At each step, the rows below the smallest last key buffered by the runs having chunks left are written, so all rows
+    sharing a key are written together in runs order, exactly like a stable sort of the concatenated runs.
+    """
+    runs = [iter(run) for run in runs]
+    buffers = [next(run, None) for run in runs]
+    pending = [buffer is not None for buffer in buffers]
+    while True:
+        limits = [buffers[i][key].iat[-1] for i in range(len(runs)) if pending[i]]
+        watermark = min(limits) if limits else None
+
+        parts = []
+        for i, buffer in enumerate(buffers):
+            if buffer is None or len(buffer) == 0:
+                continue
+            count = len(buffer) if watermark is None else buffer[key].searchsorted(watermark, side='left')
+            if count > 0:
+                parts.append(buffer.iloc[:count])
+                buffers[i] = buffer.iloc[count:]
+        if parts:
+            write(pd.concat(parts, ignore_index=True).sort_values(by=key, kind='stable', ignore_index=True))
+
+        if watermark is None:
+            return
+
+        # the runs holding the watermark only buffer rows at the watermark, extend them with their next chunk
+        for i in range(len(runs)):
+            if pending[i] and buffers[i][key].iat[-1] == watermark:
+                chunk = next(runs[i], None)
+                if chunk is None:
+                    pending[i] = False
+                else:
+                    buffers[i] = pd.concat([buffers[i], chunk], ignore_index=True)
+
+
+def read_run(paths):
+    for path in paths:
+        yield pd.read_pickle(path)
+        os.remove(path)
+
+
+def store_runs(runs_directory, days, writer):
+    """Merge the sorted runs flushed by the blocks into the events writer.
+
+    The runs of each day are first merged into a day run, stored in chunks, then the day runs are merged together with
+    bounded memory, events crossing midnight being ordered with the next days ones.
+    """
+    key = PlayerEventField.timestamp.name
+    chunk_rows = max(1000, MERGE_BUFFER_ROWS // max(1, days))
+
+    day_runs = []
+    for day in range(days):
+        paths = sorted(glob.glob(os.path.join(runs_directory, f'{day:05d}-*.pkl')))
+        if len(paths) == 0:
+            continue
+        day_events = pd.concat(map(pd.read_pickle, paths), ignore_index=True)
+        day_events = day_events.sort_values(by=[key], kind='stable', ignore_index=True)
+        for path in paths:
+            os.remove(path)
+
+        chunk_paths = []
+        for chunk, begin in enumerate(range(0, len(day_events), chunk_rows)):
+            chunk_paths.append(os.path.join(runs_directory, f'day-{day:05d}-{chunk:06d}.pkl'))
+            day_events.iloc[begin:begin + chunk_rows].to_pickle(chunk_paths[-1])
+        day_runs.append(read_run(chunk_paths))
+
+    # the streamed events are written in time order across the days, like the events sorted in memory
+    last_timestamps = [None]
+
+    def write(events):
+        timestamps = events[key].to_numpy()
+        if len(timestamps) > 0:
+            if (last_timestamps[0] is not None and timestamps[0] < last_timestamps[0]) or np.any(timestamps[1:] < timestamps[:-1]):
+                raise ValueError('the streamed events are not sorted by time')
+            last_timestamps[0] = timestamps[-1]
+        writer.write(events)
+
+    merge_runs(day_runs, key, write)
+
+
+def generate(filename, game_events_filename, date, players, days, seed, plot, overwrite, debug, hardcore, casual, churner, decay_rate, noise_scale, noise_decay_rate, engine=GameEngine.serial.name, workers=1, stream=False, storage_format=StorageFormat.csv.name, id_format=IdFormat.int.name, stages=False):
+    # set seed of the acquisition curve, the players draw from their own streams derived from the same seed
     random.seed(seed)
 
     # generate events
-    events_file = f'{filename}.csv'
+    if storage_format != StorageFormat.csv.name:
+        import_pyarrow()
+    events_file = storage_path(filename, storage_format)
 
     players_options_days = []
     players_acquisition_days = []
@@ -360,36 +1329,49 @@ def generate(filename, game_events_filename, date, players, days, seed, plot, ov
                     
 
     if not exists(events_file) or overwrite:
-        game_activity = GameActivity(
-            default_game_options(players, days, players_options_days, players_acquisition_days, players_options_presets, players_acquisition_presets),
-            date
-        )
+        game_options = default_game_options(players, days, players_options_days, players_acquisition_days, players_options_presets, players_acquisition_presets)
 
-        events_dataframe = game_activity.generate_events()
+        if stream:
+            events_directory = os.path.dirname(os.path.abspath(events_file))
+            with tempfile.TemporaryDirectory(prefix=f'.{os.path.basename(filename)}-runs-', dir=events_directory) as runs_directory:
+                generate_game_events(engine, game_options, date, seed, workers, runs_directory, stages)
 
-        if events_dataframe.size > 0:
-            events_dataframe[PlayerEventField.timestamp.name] = pd.to_datetime(
-                events_dataframe[PlayerEventField.timestamp.name], format="mixed")
-            events_dataframe = events_dataframe.sort_values(by=[PlayerEventField.timestamp.name])
+                print('storing events...')
+                writer = EventsWriter(filename, storage_format, id_format, seed)
+                store_runs(runs_directory, days, writer)
+                if writer.rows == 0:
+                    writer.write(PlayerEventBuffer(events_payload_fields(stages)).flush())
+                writer.close()
+                print(f'events stored in {events_file}!')
 
-        print('storing events...')
-        events_dataframe.to_csv(events_file, index=False)
-        print(f'events stored in {events_file}!')
+            events_dataframe = None
+
+        else:
+            events_dataframe = generate_game_events(engine, game_options, date, seed, workers, stages=stages)
+
+            print('storing events...')
+            writer = EventsWriter(filename, storage_format, id_format, seed)
+            writer.write(events_dataframe)
+            writer.close()
+            print(f'events stored in {events_file}!')
 
     else:
 
         print(f'{events_file} already exists, use --overwrite to replace the current events!')
 
         print('loading events...')
-        events_dataframe = pd.read_csv(events_file)
-        events_dataframe[PlayerEventField.timestamp.name] = pd.to_datetime(
-            events_dataframe[PlayerEventField.timestamp.name])
+        events_dataframe = read_events(filename, storage_format)
         print('events loaded!')
 
     # plot events
 
     if plot:
 
+        if events_dataframe is None:
+            print('loading events...')
+            events_dataframe = read_events(filename, storage_format)
+            print('events loaded!')
+
         # Convert the 'player_id' column to string type
         # events_dataframe[PlayerEventField.player_id.name] = events_dataframe[PlayerEventField.player_id.name].astype(str)
         print('plot events...')
@@ -428,7 +1410,7 @@ def generate(filename, game_events_filename, date, players, days, seed, plot, ov
         plot.get_figure().savefig(plot_file)
         print(f'events plotted in {plot_file}!')
 
-def simulate(filename, game_events_filename):
+def simulate(filename, game_events_filename, storage_format=StorageFormat.csv.name, id_format=IdFormat.int.name):
     simulate_file = f'{filename}.csv'
     if exists(simulate_file):
         print('loading simulate evemts...')
@@ -446,4 +1428,4 @@ def simulate(filename, game_events_filename):
             decay_rate = simulate_event['decay_rate']
             noise_scale = simulate_event['noise_scale']
             noise_decay_rate = simulate_event['noise_decay_rate']
-            generate(event_filename, game_events_filename, date, players, days, seed, False, True, False, hardcore, casual, churner, decay_rate, noise_scale, noise_decay_rate)
\ No newline at end of file
+            generate(event_filename, game_events_filename, date, players, days, seed, False, True, False, hardcore, casual, churner, decay_rate, noise_scale, noise_decay_rate, storage_format=storage_format, id_format=id_format)
\ No newline at end of file
@@ -1,12 +1,19 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
 
+import os
+import re
 from os.path import exists
 import random
+import tempfile
+import multiprocessing
+import numpy as np
 import pandas as pd
 from enum import Enum
 from functools import reduce, partial
 from pbdg.common import *
+from pbdg.storage import StorageFormat, FeaturesWriter, import_pyarrow, count_events, read_events, read_events_batches, \
+    sparse_features_paths, storage_path, write_features, write_sparse_features
 
 ONE_MINUTE_IN_SECONDS = 60
 ONE_HOUR_IN_SECONDS = ONE_MINUTE_IN_SECONDS * 60
@@ -70,6 +77,14 @@ class FeatureVariant(Enum):
     def names(cls):
         return list(map(lambda e: e.name, cls))
 
+class FeaturesEngine(Enum):
+    serial = 0
+    vectorized = 1
+
+    @classmethod
+    def names(cls):
+        return list(map(lambda e: e.name, cls))
+
 def extract_cohort_id(player_events):
     first_session_timestamp = player_events[PlayerEventField.timestamp.name].iat[0]
     return {FeatureName.cohort_id.name: first_session_timestamp.strftime("%Y_%m_%d")}
@@ -104,64 +119,75 @@ def extract_player_churn(player_events, timestamp, days):
 
     return features
 
-def extract_player_events_by_time_periods(player_events, minutes, hours, days, weeks, months, operator, prefix):
-    
-    def extract_player_events_by_time_period(player_events_by_elapsed_time_periods, time_period, suffixer):
-        features = dict()
-    
-        for time in range(0, time_period):
-            feature_suffix = suffixer(time+1)
-            if time in player_events_by_elapsed_time_periods.groups:
-                player_events_by_elapsed_time_period = player_events_by_elapsed_time_periods.get_group(time).groupby(PlayerEventField.event_type.name)
-                for event_type in PlayerEventType:
-                    feature_name = f'{event_type.name.lower()}{feature_suffix}'
-                    if event_type.name in player_events_by_elapsed_time_period.groups:  
-                        player_events_by_elapsed_time_period_and_event_type = player_events_by_elapsed_time_period.get_group(event_type.name)
-                        features[feature_name] = operator(player_events_by_elapsed_time_period_and_event_type)
-                    else:
-                        features[feature_name] = 0
-            else:
-                for event_type in PlayerEventType:
-                    features[f'{event_type.name.lower()}{feature_suffix}'] = 0
-        
-        return features
-    
-    features = dict()
+def group_player_events_by_time_periods(player_events, time_periods, event_type_codes):
+    """Return the positions of the player events in each (time period, event type code) cell of each window.
 
-    last_session_timestamp = player_events[PlayerEventField.timestamp.name].iat[-1]
+    The elapsed seconds to the last event and the event type codes are computed once and shared by all the windows,
+    the windows without time periods being skipped. The positions of each cell are in events order.
+    """
+    timestamps = player_events[PlayerEventField.timestamp.name]
+    elapsed_seconds = ((timestamps.iat[-1] - timestamps) // pd.Timedelta(seconds=1)).to_numpy()
+    event_codes = player_events[EVENT_TYPE_CODE].to_numpy().astype(np.int64)
+    codes_count = max(event_codes.max(), max(event_type_codes.values())) + 2
 
-    elapsed_time_in_seconds = 'elapsed_time_in_seconds'
-    elapsed_time_in_minutes = 'elapsed_time_in_minutes'
-    elapsed_time_in_hours = 'elapsed_time_in_hours'
-    elapsed_time_in_days = 'elapsed_time_in_days'
-    elapsed_time_in_weeks = 'elapsed_time_in_weeks' 
-    elapsed_time_in_months = 'elapsed_time_in_months' 
-
-    player_events[elapsed_time_in_seconds] = player_events[PlayerEventField.timestamp.name].apply(lambda d: int((last_session_timestamp-d).total_seconds()))
-    player_events[elapsed_time_in_minutes] = player_events[elapsed_time_in_seconds] // ONE_MINUTE_IN_SECONDS 
-    player_events[elapsed_time_in_hours] = player_events[elapsed_time_in_seconds] // ONE_HOUR_IN_SECONDS
-    player_events[elapsed_time_in_days] = player_events[elapsed_time_in_seconds] // ONE_DAY_IN_SECONDS
-    player_events[elapsed_time_in_weeks] = player_events[elapsed_time_in_seconds] // ONE_WEEK_IN_SECONDS
-    player_events[elapsed_time_in_months] = player_events[elapsed_time_in_seconds] // ONE_MONTH_IN_SECONDS
-
-    features.update(extract_player_events_by_time_period(player_events.groupby(elapsed_time_in_minutes), minutes, partial(FeatureName.last_minute_suffix, prefix=prefix)))
-    features.update(extract_player_events_by_time_period(player_events.groupby(elapsed_time_in_hours), hours, partial(FeatureName.last_hour_suffix, prefix=prefix)))
-    features.update(extract_player_events_by_time_period(player_events.groupby(elapsed_time_in_days), days, partial(FeatureName.last_day_suffix, prefix=prefix)))
-    features.update(extract_player_events_by_time_period(player_events.groupby(elapsed_time_in_weeks), weeks, partial(FeatureName.last_week_suffix, prefix=prefix)))
-    features.update(extract_player_events_by_time_period(player_events.groupby(elapsed_time_in_months), months, partial(FeatureName.last_month_suffix, prefix=prefix)))
+    windows = []
+    for time_period, periods, suffixer in time_periods:
+        if periods <= 0:
+            continue
+        elapsed_periods = elapsed_seconds // time_period
+        positions = np.flatnonzero(elapsed_periods < periods)
+        keys = elapsed_periods[positions] * codes_count + event_codes[positions] + 1
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        positions = positions[order]
+        bounds = np.flatnonzero(np.diff(keys, prepend=-1, append=-1))
+        cells = {
+            divmod(int(keys[begin]), codes_count): positions[begin:end]
+            for begin, end in zip(bounds[:-1], bounds[1:])
+        }
+        windows.append((periods, suffixer, cells))
+    return windows
 
-    return features
+def extract_player_events_by_time_periods(player_events, time_periods, operators, event_type_codes, matrices, rows):
+    """Extract the events features of the requested variants into the row of the player in the variants matrices.
+
+    The windows cells are grouped once for all the variants, each variant operator being evaluated on the timestamps
+    of each cell, the cells without events being null features.
+    """
+    row = rows[player_events.name]
+    windows = group_player_events_by_time_periods(player_events, time_periods, event_type_codes)
+    timestamps = player_events[PlayerEventField.timestamp.name]
+
+    for prefix, operator in operators:
+        matrix = matrices[prefix]
+        column = 0
+        for periods, suffixer, cells in windows:
+            for time in range(0, periods):
+                for event_type in PlayerEventType:
+                    positions = cells.get((time, event_type_codes[event_type.name] + 1))
+                    if positions is not None:
+                        matrix[row, column] = operator(timestamps.take(positions))
+                    column += 1
+
+    return dict()
 
-def extract_player_events_count(player_events_by_elapsed_time_period_and_event_type):
-    return player_events_by_elapsed_time_period_and_event_type[PlayerEventField.id.name].count()
+def extract_player_events_count(timestamps):
+    return timestamps.count()
 
-def extract_player_events_time_of_day_mean(player_events_by_elapsed_time_period_and_event_type):
-    timestamp = player_events_by_elapsed_time_period_and_event_type[PlayerEventField.timestamp.name].mean()
+def extract_player_events_time_of_day_mean(timestamps):
+    timestamp = timestamps.mean()
     timedelta = timestamp - pd.Timestamp(year=timestamp.year, month=timestamp.month, day=timestamp.day)
     return timedelta.total_seconds()
     
-def extract_player_events_time_of_day_std(player_events_by_elapsed_time_period_and_event_type):
-    return player_events_by_elapsed_time_period_and_event_type[PlayerEventField.timestamp.name].std().total_seconds()
+def extract_player_events_time_of_day_std(timestamps):
+    return timestamps.std().total_seconds()
+
+# the operators of the features variants, applied to the timestamps of the events of a window cell
+FEATURES_VARIANTS_OPERATORS = {
+    FeatureVariant.count.name: extract_player_events_count,
+    FeatureVariant.time_of_day_mean.name: extract_player_events_time_of_day_mean,
+    FeatureVariant.time_of_day_std.name: extract_player_events_time_of_day_std,
+}
 
 def extract_features(player_events, extractors, counter):
     def extract(features, extractor):   
@@ -173,21 +199,40 @@ def extract_features(player_events, extractors, counter):
     
     return pd.Series(reduce(extract, extractors, dict()))
 
+# the integer codes of the categorical event types, the features extractors group the events by them
+EVENT_TYPE_CODE = 'event_type_code'
+
+# the events columns read by the features extractors
+FEATURES_EVENTS_FIELDS = [
+    PlayerEventField.event_type.name,
+    PlayerEventField.timestamp.name,
+    PlayerEventField.player_id.name,
+    PlayerEventField.player_type.name,
+    PlayerEventField.session_id.name,
+]
+
 class FeaturesOptions:
 
     def __init__(self, churn_days, last_minutes, last_hours, lasy_days,
-                                last_weeks, last_months):
+                                last_weeks, last_months, variants=None):
         self.churn_days = churn_days
         self.last_minutes = last_minutes
         self.last_hours = last_hours
         self.last_days = lasy_days
         self.last_weeks = last_weeks
         self.last_months = last_months
+        # the requested features variants, in FeatureVariant order
+        self.variants = [name for name in FeatureVariant.names() if variants is None or name in variants]
 
-def generate_player_features(game_events, features_options):
+def generate_player_features(game_events, features_options, churn_timestamp=None):
 
     game_events[PlayerEventField.timestamp.name] = pd.to_datetime(game_events[PlayerEventField.timestamp.name])
-    game_events = game_events.sort_values(by=[PlayerEventField.timestamp.name])
+    game_events = game_events.sort_values(by=[PlayerEventField.timestamp.name], kind='stable')
+
+    # group the events by the codes of their types, the types missing from the categories never match a code
+    event_types = game_events[PlayerEventField.event_type.name].astype('category').cat
+    game_events[EVENT_TYPE_CODE] = event_types.codes
+    event_type_codes = {name: event_types.categories.get_loc(name) if name in event_types.categories else -1 for name in PlayerEventType.names()}
     game_events_by_player_id = game_events.groupby(PlayerEventField.player_id.name)
 
     # add player ids
@@ -199,16 +244,23 @@ def generate_player_features(game_events, features_options):
 
     # extract features
 
-    churn_timestamp = game_events[PlayerEventField.timestamp.name].iat[-1]
+    if churn_timestamp is None:
+        churn_timestamp = game_events[PlayerEventField.timestamp.name].iat[-1]
     churn_days = features_options.churn_days
 
+    # the variants features are written in column-major matrices, the counts one being an integer matrix
+    matrices = {
+        variant: np.zeros((player_count, len(features_variant_columns(features_options, variant))),
+                          dtype=np.int64 if variant == FeatureVariant.count.name else np.float64, order='F')
+        for variant in features_options.variants
+    }
     extract_player_events = partial(
         extract_player_events_by_time_periods, 
-        minutes=features_options.last_minutes, 
-        hours=features_options.last_hours, 
-        days=features_options.last_days, 
-        weeks=features_options.last_weeks, 
-        months=features_options.last_months, 
+        time_periods=features_time_periods(features_options),
+        operators=[(variant, FEATURES_VARIANTS_OPERATORS[variant]) for variant in features_options.variants],
+        event_type_codes=event_type_codes,
+        matrices=matrices,
+        rows={player_id: row for row, player_id in enumerate(player_features.index)},
     )
     
     counter = Counter(1, player_count)
@@ -224,15 +276,7 @@ def generate_player_features(game_events, features_options):
             partial(extract_player_churn, 
                     timestamp=churn_timestamp, 
                     days=churn_days),
-            partial(extract_player_events,
-                    operator=extract_player_events_count,
-                    prefix=FeatureVariant.count.name),
-            partial(extract_player_events,
-                    operator=extract_player_events_time_of_day_mean,
-                    prefix=FeatureVariant.time_of_day_mean.name),
-            partial(extract_player_events,
-                    operator=extract_player_events_time_of_day_std,
-                    prefix=FeatureVariant.time_of_day_std.name)
+            extract_player_events
         ],
         counter = counter
     )
@@ -242,10 +286,701 @@ def generate_player_features(game_events, features_options):
     extracted_features = game_events_by_player_id.apply(features_extractor)
     player_features = pd.merge(player_features, extracted_features, left_index=True, right_index=True)
 
+    return pd.concat([player_features, features_variants_frame(player_features.index, matrices, features_options)], axis=1)
+
+def features_variant_columns(features_options, variant):
+    """Return the features columns of a variant, in windows, time periods then event types order."""
+    return [
+        f'{event_type.name.lower()}{suffixer(time + 1, prefix=variant)}'
+        for _, time_periods, suffixer in features_time_periods(features_options)
+        for time in range(time_periods) for event_type in PlayerEventType
+    ]
+
+def features_variants_frame(index, matrices, features_options):
+    """Return the DataFrame of the (players, columns) variants matrices, in variants order.
+
+    The counts are downcast to the smallest unsigned integer type holding them, the matrices being stored column-major
+    so each variant is a single DataFrame block without copy.
+    """
+    frames = []
+    for variant in features_options.variants:
+        matrix = matrices[variant]
+        if variant == FeatureVariant.count.name:
+            matrix = matrix.astype(np.min_scalar_type(matrix.max() if matrix.size > 0 else 0), order='F')
+        frames.append(pd.DataFrame(
+            np.asfortranarray(matrix), index=index, columns=features_variant_columns(features_options, variant), copy=False))
+    return pd.concat(frames, axis=1) if len(frames) > 0 else pd.DataFrame(index=index)
+
+ONE_SECOND_IN_NANOSECONDS = 1000000000
+ONE_DAY_IN_NANOSECONDS = ONE_DAY_IN_SECONDS * ONE_SECOND_IN_NANOSECONDS
+
+def features_time_periods(features_options):
+    """Return the (time period in seconds, number of periods, suffixer) of each features window, in features order."""
+    return [
+        (ONE_MINUTE_IN_SECONDS, features_options.last_minutes, FeatureName.last_minute_suffix),
+        (ONE_HOUR_IN_SECONDS, features_options.last_hours, FeatureName.last_hour_suffix),
+        (ONE_DAY_IN_SECONDS, features_options.last_days, FeatureName.last_day_suffix),
+        (ONE_WEEK_IN_SECONDS, features_options.last_weeks, FeatureName.last_week_suffix),
+        (ONE_MONTH_IN_SECONDS, features_options.last_months, FeatureName.last_month_suffix),
+    ]
+
+def generate_vectorized_player_features(game_events, features_options, churn_timestamp=None):
+    """Generate the same features as generate_player_features for all the players at once.
+
+    The elapsed time periods of the events are computed for every window in one NumPy pass, then the counts, the time
+    of day sums and the squared deviations of each (player, time period, event type) cell are aggregated with bincount
+    and reshaped into the features columns. The time of day features are computed from the events offsets to the last
+    event of their player, so they only differ from the per player ones by the rounding of the timestamps sums.
+    """
+    game_events[PlayerEventField.timestamp.name] = pd.to_datetime(game_events[PlayerEventField.timestamp.name])
+    game_events = game_events.sort_values(by=[PlayerEventField.timestamp.name], kind='stable')
+
+    # number the players in order of first event, and order the events by player then time
+    players, player_ids = pd.factorize(game_events[PlayerEventField.player_id.name])
+    player_count = len(player_ids)
+    order = np.argsort(players, kind='stable')
+    players = players[order]
+    timestamps = game_events[PlayerEventField.timestamp.name].to_numpy(dtype='datetime64[ns]').view(np.int64)[order]
+    player_counts = np.bincount(players, minlength=player_count)
+    firsts = np.cumsum(player_counts) - player_counts
+    lasts = firsts + player_counts - 1
+    first_timestamps = timestamps[firsts]
+    last_timestamps = timestamps[lasts]
+
+    # map the event types to their PlayerEventType index, the unknown types being dropped
+    event_types = game_events[PlayerEventField.event_type.name].astype('category').cat
+    event_types_indices = np.array(
+        [PlayerEventType.names().index(name) if name in PlayerEventType.names() else -1 for name in event_types.categories] + [-1]
+    )[event_types.codes.to_numpy()[order]]
+    event_types_count = len(PlayerEventType)
+
+    player_features = pd.DataFrame(index=pd.Index(player_ids, name=FeatureName.player_id.name))
+    first_dates = pd.DatetimeIndex(first_timestamps.view('datetime64[ns]'))
+    player_features[FeatureName.cohort_id.name] = first_dates.strftime('%Y_%m_%d').to_numpy()
+    player_features[FeatureName.cohort_day_of_week.name] = first_dates.day_of_week.to_numpy()
+    player_features[FeatureName.player_type.name] = np.asarray(game_events[PlayerEventField.player_type.name].to_numpy())[order][firsts]
+    player_features[FeatureName.player_lifetime.name] = (last_timestamps - first_timestamps) / ONE_SECOND_IN_NANOSECONDS
+
+    sessions = game_events[PlayerEventField.session_id.name].to_numpy()[order]
+    session_codes = pd.factorize(sessions)[0]
+    new_sessions = np.ones(len(sessions), dtype=bool)
+    session_order = np.lexsort((session_codes, players))
+    new_sessions[1:] = (players[session_order][1:] != players[session_order][:-1]) | \
+        (session_codes[session_order][1:] != session_codes[session_order][:-1])
+    player_features[FeatureName.session_count.name] = np.bincount(players[session_order][new_sessions], minlength=player_count)
+
+    if churn_timestamp is None:
+        churn_timestamp = game_events[PlayerEventField.timestamp.name].iat[-1]
+    churn_timestamp = churn_timestamp.value
+    player_features[FeatureName.player_churn.name] = \
+        (churn_timestamp - last_timestamps) // ONE_DAY_IN_NANOSECONDS > features_options.churn_days
+
+    # elapsed seconds to the last event of the player, and offsets to it in nanoseconds
+    offsets = timestamps - last_timestamps[players]
+    elapsed_seconds = -offsets // ONE_SECOND_IN_NANOSECONDS
+    last_times_of_day = last_timestamps % ONE_DAY_IN_NANOSECONDS
+
+    variants = {variant: [] for variant in features_options.variants}
+    for time_period, time_periods, suffixer in features_time_periods(features_options):
+        if time_periods <= 0:
+            continue
+        periods = elapsed_seconds // time_period
+        mask = (periods < time_periods) & (event_types_indices >= 0)
+        cells = (players[mask] * time_periods + periods[mask]) * event_types_count + event_types_indices[mask]
+        cells_count = player_count * time_periods * event_types_count
+        cells_offsets = offsets[mask].astype(np.float64)
+
+        # the variants share the counts, the time of day ones the means, only the requested ones are computed
+        counts = np.bincount(cells, minlength=cells_count)
+        empty = counts == 0
+        values = {FeatureVariant.count.name: counts}
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if FeatureVariant.time_of_day_mean.name in features_options.variants or FeatureVariant.time_of_day_std.name in features_options.variants:
+                means = np.bincount(cells, weights=cells_offsets, minlength=cells_count) / counts
+            if FeatureVariant.time_of_day_mean.name in features_options.variants:
+                times_of_day = (np.repeat(last_times_of_day, time_periods * event_types_count) + means) % ONE_DAY_IN_NANOSECONDS / ONE_SECOND_IN_NANOSECONDS
+                # the cells without events are null features
+                times_of_day[empty] = 0
+                values[FeatureVariant.time_of_day_mean.name] = times_of_day
+            if FeatureVariant.time_of_day_std.name in features_options.variants:
+                deviations = np.bincount(cells, weights=(cells_offsets - means[cells]) ** 2, minlength=cells_count)
+                stds = np.sqrt(deviations / (counts - 1)) / ONE_SECOND_IN_NANOSECONDS
+                stds[empty] = 0
+                values[FeatureVariant.time_of_day_std.name] = stds
+
+        for variant in features_options.variants:
+            variants[variant].append(values[variant].reshape(player_count, -1))
+
+    matrices = {
+        variant: np.concatenate(variants[variant], axis=1) if len(variants[variant]) > 0 else np.zeros((player_count, 0))
+        for variant in features_options.variants
+    }
+    return pd.concat([player_features, features_variants_frame(player_features.index, matrices, features_options)], axis=1)
+
+FEATURES_ENGINES = {
+    FeaturesEngine.serial.name: generate_player_features,
+    FeaturesEngine.vectorized.name: generate_vectorized_player_features,
+}
+
+# the units of the --windows durations, in seconds
+WINDOW_UNITS = {
+    's': 1,
+    'm': ONE_MINUTE_IN_SECONDS,
+    'h': ONE_HOUR_IN_SECONDS,
+    'd': ONE_DAY_IN_SECONDS,
+    'w': ONE_WEEK_IN_SECONDS,
+}
+
+WINDOW_DURATION_PATTERN = re.compile(r'^(\d+)([smhdw])$')
+
+# the events value summed over the windows
+WINDOW_VALUE_FIELD = PlayerEventField.item_value.name
+
+class FeaturesWindow:
+    """Windows of a duration ending every stride before the last event of a player, the first one ending on it."""
+
+    def __init__(self, duration, stride, count):
+        self.duration = duration
+        self.stride = stride
+        self.count = count
+
+    @classmethod
+    def parse(cls, window):
+        """Parse a DURATION[:STRIDE[:COUNT]] window, the durations being numbers of s, m, h, d or w."""
+        fields = window.strip().split(':')
+        if not 1 <= len(fields) <= 3:
+            raise ValueError(f'{window} is not a DURATION[:STRIDE[:COUNT]] window')
+        for duration in fields[:2]:
+            if WINDOW_DURATION_PATTERN.match(duration) is None:
+                raise ValueError(f'{duration} is not a duration (a number of s, m, h, d or w)')
+        stride = fields[1] if len(fields) > 1 else fields[0]
+        count = int(fields[2]) if len(fields) > 2 else 1
+        return cls(fields[0], stride, count)
+
+    def seconds(self, duration):
+        value, unit = WINDOW_DURATION_PATTERN.match(duration).groups()
+        return int(value) * WINDOW_UNITS[unit]
+
+    def suffix(self, window):
+        name = f'last_{self.duration}' if self.stride == self.duration else f'last_{self.duration}_every_{self.stride}'
+        return f'_{name}(-{window})'
+
+def parse_windows(windows):
+    return [FeaturesWindow.parse(window) for window in windows.split(',')]
+
+class PlayerEventsIndex:
+    """Time index of the events of the players, built once to answer any window with two binary searches.
+
+    The events are sorted by player then time, with the cumulative counts of each event type and the cumulative sum of
+    the events values, so the events of a player in a time range are the difference of the cumulative sums at the
+    positions found by binary search in the player timestamps.
+    """
+
+    def __init__(self, players, timestamps, event_types_indices, values, player_count):
+        order = np.lexsort((timestamps, players))
+        self.timestamps = timestamps[order]
+        player_counts = np.bincount(players, minlength=player_count)
+        self.ends = np.cumsum(player_counts)
+        self.firsts = self.ends - player_counts
+
+        event_types = np.zeros((len(order) + 1, len(PlayerEventType)), dtype=np.int64)
+        known = event_types_indices[order] >= 0
+        event_types[np.flatnonzero(known) + 1, event_types_indices[order][known]] = 1
+        self.cumulative_counts = np.cumsum(event_types, axis=0)
+        self.cumulative_values = np.concatenate(([0.0], np.cumsum(np.nan_to_num(values[order]))))
+
+    def search(self, players, times):
+        """Return the positions after the last events of the players at or before the times, by vectorized binary search."""
+        low = self.firsts[players].copy()
+        high = self.ends[players].copy()
+        while True:
+            searching = low < high
+            if not searching.any():
+                return low
+            middle = (low + high) // 2
+            after = searching & (self.timestamps[np.minimum(middle, len(self.timestamps) - 1)] <= times)
+            before = searching & ~after
+            low[after] = middle[after] + 1
+            high[before] = middle[before]
+
+    def aggregate(self, players, begins, ends):
+        """Return the events counts by event type and the values sum of the players in the (begin, end] time ranges."""
+        lows = self.search(players, begins)
+        highs = self.search(players, ends)
+        return self.cumulative_counts[highs] - self.cumulative_counts[lows], self.cumulative_values[highs] - self.cumulative_values[lows]
+
+def generate_windows_player_features(game_events, windows, player_ids):
+    """Generate the events counts by event type and the values sum of the windows of the players of player_ids.
+
+    The index of the events is built once, each window of each player costing two binary searches in the player events.
+    """
+    players = pd.Index(player_ids).get_indexer(game_events[PlayerEventField.player_id.name])
+    timestamps = pd.to_datetime(game_events[PlayerEventField.timestamp.name]).to_numpy(dtype='datetime64[ns]').view(np.int64)
+    event_types = game_events[PlayerEventField.event_type.name].astype('category').cat
+    event_types_indices = np.array(
+        [PlayerEventType.names().index(name) if name in PlayerEventType.names() else -1 for name in event_types.categories] + [-1]
+    )[event_types.codes.to_numpy()]
+    values = game_events[WINDOW_VALUE_FIELD].to_numpy(dtype=np.float64, na_value=np.nan)
+    index = PlayerEventsIndex(players, timestamps, event_types_indices, values, len(player_ids))
+
+    all_players = np.arange(len(player_ids))
+    last_timestamps = index.timestamps[index.ends - 1]
+    columns = dict()
+    for window in windows:
+        duration = window.seconds(window.duration) * ONE_SECOND_IN_NANOSECONDS
+        stride = window.seconds(window.stride) * ONE_SECOND_IN_NANOSECONDS
+        for time in range(window.count):
+            ends = last_timestamps - time * stride
+            counts, sums = index.aggregate(all_players, ends - duration, ends)
+            suffix = window.suffix(time + 1)
+            for event_type_index, event_type in enumerate(PlayerEventType):
+                columns[f'{event_type.name.lower()}_{FeatureVariant.count.name}{suffix}'] = counts[:, event_type_index]
+            columns[f'{WINDOW_VALUE_FIELD}_sum{suffix}'] = sums
+
+    # the counts are downcast to the smallest unsigned integer type holding them, like the variants counts
+    max_count = max([values.max() for column, values in columns.items() if not column.startswith(WINDOW_VALUE_FIELD)], default=0)
+    return pd.DataFrame({
+        column: values if column.startswith(WINDOW_VALUE_FIELD) else values.astype(np.min_scalar_type(max_count))
+        for column, values in columns.items()
+    }, index=pd.Index(player_ids, name=FeatureName.player_id.name))
+
+# the columns of a players shard, stored as NumPy files memory mapped by the workers
+SHARD_COLUMNS = [
+    PlayerEventField.timestamp.name,
+    PlayerEventField.player_id.name,
+    PlayerEventField.session_id.name,
+    PlayerEventField.event_type.name,
+    PlayerEventField.player_type.name,
+]
+
+def shard_column_path(shard_directory, column):
+    return os.path.join(shard_directory, f'{column}.bin')
+
+def create_shards_directories(shards_directory, shards):
+    """Create the shards directories, with an empty file per column the shards events are appended to."""
+    shards_directories = []
+    for shard in range(shards):
+        shard_directory = os.path.join(shards_directory, f'shard-{shard:05d}')
+        os.makedirs(shard_directory)
+        for column in SHARD_COLUMNS:
+            open(shard_column_path(shard_directory, column), 'wb').close()
+        shards_directories.append(shard_directory)
+    return shards_directories
+
+def append_shards_columns(shards_directories, events_shards, columns):
+    """Append events columns to the shards files, the events of each shard keeping their order."""
+    order = np.argsort(events_shards, kind='stable')
+    bounds = np.searchsorted(events_shards[order], np.arange(len(shards_directories) + 1))
+    for shard, shard_directory in enumerate(shards_directories):
+        begin, end = bounds[shard], bounds[shard + 1]
+        if begin == end:
+            continue
+        shard_order = order[begin:end]
+        for column in SHARD_COLUMNS:
+            with open(shard_column_path(shard_directory, column), 'ab') as file:
+                np.ascontiguousarray(columns[column][shard_order]).tofile(file)
+
+def load_shard_column(shard_directory, column, dtype):
+    path = shard_column_path(shard_directory, column)
+    if os.path.getsize(path) == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r')
+
+def generate_shard_features(task):
+    """Generate the features of a players shard, its players and sessions being numbered by codes."""
+    shard_directory, engine, features_options, churn_timestamp, categories, dtypes = task
+    columns = {column: np.asarray(load_shard_column(shard_directory, column, dtypes[column])) for column in SHARD_COLUMNS}
+    game_events = pd.DataFrame({
+        PlayerEventField.timestamp.name: columns[PlayerEventField.timestamp.name],
+        PlayerEventField.player_id.name: columns[PlayerEventField.player_id.name],
+        PlayerEventField.session_id.name: columns[PlayerEventField.session_id.name],
+        **{
+            name: pd.Categorical.from_codes(columns[name], categories=categories[name])
+            for name in categories
+        }
+    })
+    return FEATURES_ENGINES[engine](game_events, features_options, churn_timestamp)
+
+def generate_sharded_player_features(game_events, features_options, engine, workers, shards_directory):
+    """Generate the features in a process pool, the players being partitioned into shards by hashed player id.
+
+    The shards columns are written as raw files memory mapped by the workers, with the players, sessions and
+    categories replaced by integer codes. The features of the shards are put back in the players order of a single
+    process run, whatever the number of workers.
+    """
+    game_events[PlayerEventField.timestamp.name] = pd.to_datetime(game_events[PlayerEventField.timestamp.name])
+    game_events = game_events.sort_values(by=[PlayerEventField.timestamp.name], kind='stable')
+    churn_timestamp = game_events[PlayerEventField.timestamp.name].iat[-1]
+
+    players, player_ids = pd.factorize(game_events[PlayerEventField.player_id.name])
+    shards = pd.util.hash_array(np.asarray(player_ids)) % np.uint64(workers)
+    columns = {
+        PlayerEventField.timestamp.name: game_events[PlayerEventField.timestamp.name].to_numpy(),
+        PlayerEventField.player_id.name: players.astype(np.int64),
+        PlayerEventField.session_id.name: pd.factorize(game_events[PlayerEventField.session_id.name])[0].astype(np.int64),
+    }
+    categories = dict()
+    for name in [PlayerEventField.event_type.name, PlayerEventField.player_type.name]:
+        values = game_events[name].astype('category').cat
+        columns[name] = values.codes.to_numpy()
+        categories[name] = values.categories
+    dtypes = {column: values.dtype for column, values in columns.items()}
+
+    shards_directories = create_shards_directories(shards_directory, workers)
+    append_shards_columns(shards_directories, shards[players].astype(np.int64), columns)
+    del columns
+    tasks = [
+        (shard_directory, engine, features_options, churn_timestamp, categories, dtypes)
+        for shard_directory in shards_directories
+    ]
+
+    with multiprocessing.Pool(workers) as pool:
+        shards_features = pool.map(generate_shard_features, tasks)
+
+    player_features = pd.concat(shards_features).sort_index()
+    player_features.index = pd.Index(np.asarray(player_ids)[player_features.index], name=FeatureName.player_id.name)
     return player_features
 
+def batch_features_dtypes(player_features):
+    """Return the features with the types of the features written one batch after the other.
+
+    The counts, downcast to the smallest type of each batch, are 32-bit unsigned integers so all the batches share
+    their types."""
+    columns = {
+        column: np.uint32 for column, dtype in player_features.dtypes.items()
+        if dtype != np.uint32 and f'_{FeatureVariant.count.name}_' in column
+    }
+    return player_features.astype(columns) if len(columns) > 0 else player_features.copy()
+
+class ChunkedCategories:
+    """Number the categories of an enum column read in chunks, the codes staying the same from one chunk to the next."""
+
+    def __init__(self):
+        self.categories = []
+        self.codes = dict()
+
+    def encode(self, values):
+        values = values.astype('category').cat
+        for category in values.categories:
+            if category not in self.codes:
+                self.codes[category] = len(self.categories)
+                self.categories.append(category)
+        mapping = np.array([self.codes[category] for category in values.categories] + [-1], dtype=np.int8)
+        return mapping[values.codes.to_numpy()]
+
+def generate_chunked_player_features(events, events_format, features_options, engine, workers, chunk_size,
+                                     shards_directory, features_writer):
+    """Generate the features of events larger than memory, the events being read in chunks of chunk_size rows.
+
+    A first pass streams the chunks into player shards holding about chunk_size events each, the players being
+    hashed so each shard holds all the events of its players, and keeps the churn timestamp. The players are numbered
+    in order of appearance, the sessions by a 64-bit hash, and the categories by codes shared by all the chunks. A
+    second pass featurizes the shards one by one, in a process pool when there are several workers, so only a shard,
+    not the events, is ever loaded in memory. The features of the shards, a row per player, are then put back in the
+    players order of appearance and written, like the features of the events loaded in memory.
+    """
+    shards = max(workers, -(-count_events(events, events_format) // chunk_size), 1)
+    shards_directories = create_shards_directories(shards_directory, shards)
+
+    player_codes = dict()
+    player_ids = []
+    categories = {
+        PlayerEventField.event_type.name: ChunkedCategories(),
+        PlayerEventField.player_type.name: ChunkedCategories(),
+    }
+    churn_timestamp = None
+    dtypes = None
+    chunks = 0
+    for chunk in read_events_batches(events, events_format, FEATURES_EVENTS_FIELDS, chunk_size):
+        if len(chunk) == 0:
+            continue
+        timestamps = pd.to_datetime(chunk[PlayerEventField.timestamp.name]).to_numpy()
+        if dtypes is not None:
+            timestamps = timestamps.astype(dtypes[PlayerEventField.timestamp.name])
+        chunk_churn_timestamp = timestamps.max()
+        if churn_timestamp is None or chunk_churn_timestamp > churn_timestamp:
+            churn_timestamp = chunk_churn_timestamp
+
+        ids = chunk[PlayerEventField.player_id.name]
+        players = ids.map(player_codes)
+        new_ids = pd.unique(ids[players.isna()])
+        player_codes.update(zip(new_ids, range(len(player_ids), len(player_ids) + len(new_ids))))
+        player_ids.extend(new_ids)
+        players = ids.map(player_codes) if len(new_ids) > 0 else players
+
+        columns = {
+            PlayerEventField.timestamp.name: timestamps,
+            PlayerEventField.player_id.name: players.to_numpy(dtype=np.int64),
+            PlayerEventField.session_id.name: pd.util.hash_array(chunk[PlayerEventField.session_id.name].to_numpy()).view(np.int64),
+            **{name: values.encode(chunk[name]) for name, values in categories.items()},
+        }
+        if dtypes is None:
+            dtypes = {column: values.dtype for column, values in columns.items()}
+        events_shards = (pd.util.hash_array(ids.to_numpy()) % np.uint64(shards)).astype(np.int64)
+        append_shards_columns(shards_directories, events_shards, columns)
+        chunks += 1
+        print(f'{chunks} events chunks sharded...', end='\r')
+    print()
+    del player_codes
+
+    if dtypes is None:
+        print('no events to featurize!')
+        return
+
+    player_ids = np.asarray(player_ids)
+    categories = {name: pd.Index(values.categories) for name, values in categories.items()}
+    tasks = [
+        (shard_directory, engine, features_options, pd.Timestamp(churn_timestamp), categories, dtypes)
+        for shard_directory in shards_directories
+    ]
+
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    shards_features = pool.imap(generate_shard_features, tasks) if pool is not None else map(generate_shard_features, tasks)
+    try:
+        features_shards = []
+        for shard, player_features in enumerate(shards_features):
+            if len(player_features) > 0:
+                features_shards.append(batch_features_dtypes(player_features))
+            print(f'{shard + 1}/{len(tasks)} shards featurized...', end='\r')
+        print()
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+    if len(features_shards) > 0:
+        player_features = pd.concat(features_shards).sort_index()
+        del features_shards
+        player_features.index = pd.Index(player_ids[player_features.index.to_numpy(dtype=np.int64)], name=FeatureName.player_id.name)
+        features_writer.write(player_features)
+
+FEATURES_STATE_OPTIONS = ['churn_days', 'last_minutes', 'last_hours', 'last_days', 'last_weeks', 'last_months']
+
+def features_state_horizon(features_options):
+    """Return the time in nanoseconds before the last event of a player where its events are still in a window.
+
+    The horizon is at least a day, so the sessions going on when new events arrive are kept in the state."""
+    horizon = max([ONE_DAY_IN_SECONDS] + [time_period * time_periods for time_period, time_periods, _ in features_time_periods(features_options)])
+    return horizon * ONE_SECOND_IN_NANOSECONDS
+
+def prune_features_state_events(players, timestamps, sessions, last_timestamps, features_options):
+    """Return the mask of the events kept in the state, the sessions ending in the horizon of their player."""
+    sessions_ends = pd.Series(timestamps).groupby([players, sessions]).transform('max').to_numpy()
+    return sessions_ends >= last_timestamps[players] - features_state_horizon(features_options)
+
+def build_features_state(game_events, player_features, features_options):
+    """Build the features state of the players of the features, computed from all the game events.
+
+    The state holds the features rows, the first and last timestamps of the players, the churn timestamp, and the
+    events of the players in their features windows, the only ones needed to update the windows with new events.
+    """
+    timestamps = pd.to_datetime(game_events[PlayerEventField.timestamp.name]).to_numpy(dtype='datetime64[ns]').view(np.int64)
+    player_ids = player_features.index.to_numpy()
+    players = pd.Index(player_ids).get_indexer(game_events[PlayerEventField.player_id.name])
+    first_timestamps = np.full(len(player_ids), np.iinfo(np.int64).max)
+    np.minimum.at(first_timestamps, players, timestamps)
+    last_timestamps = np.full(len(player_ids), np.iinfo(np.int64).min)
+    np.maximum.at(last_timestamps, players, timestamps)
+    sessions = game_events[PlayerEventField.session_id.name].to_numpy()
+    event_types = game_events[PlayerEventField.event_type.name].astype('category').cat
+
+    kept = prune_features_state_events(players, timestamps, sessions, last_timestamps, features_options)
+    return {
+        'options': np.array([getattr(features_options, option) for option in FEATURES_STATE_OPTIONS]),
+        'variants': np.array(features_options.variants),
+        'churn_timestamp': np.array(timestamps.max()),
+        'player_ids': player_ids,
+        'first_timestamps': first_timestamps,
+        'last_timestamps': last_timestamps,
+        'event_types': np.asarray(event_types.categories, dtype=str),
+        'events_players': players[kept],
+        'events_timestamps': timestamps[kept],
+        'events_sessions': sessions[kept],
+        'events_types': event_types.codes.to_numpy()[kept],
+        'features_columns': np.asarray(player_features.columns, dtype=str),
+        **{f'features.{column}': player_features[column].to_numpy() for column in player_features.columns},
+    }
+
+def save_features_state(state, filename):
+    arrays = dict()
+    for key, values in state.items():
+        values = np.asarray(values)
+        # the ids and enums objects arrays are stored as strings, so the state is loaded without pickle
+        arrays[key] = values.astype(str) if values.dtype == object else values
+    with open(filename, 'wb') as file:
+        np.savez(file, **arrays)
+
+def load_features_state(filename):
+    with np.load(filename) as state:
+        return {key: state[key] for key in state.files}
+
+def update_player_features(state, game_events, features_options, engine=FeaturesEngine.serial.name):
+    """Update the features state with new game events, and return the features of all the players and the new state.
+
+    Only the players with new events are featurized again, from their state events and their new events, their
+    session counts adding the new sessions to the state ones. The churn of all the players is computed again from the
+    new churn timestamp, and the new players are appended in order of first event.
+    """
+    churn_days = features_options.churn_days
+    player_features = pd.DataFrame(
+        {column: state[f'features.{column}'] for column in state['features_columns']},
+        index=pd.Index(state['player_ids'], name=FeatureName.player_id.name))
+
+    game_events = game_events.sort_values(by=[PlayerEventField.timestamp.name], kind='stable')
+    timestamps = pd.to_datetime(game_events[PlayerEventField.timestamp.name]).to_numpy(dtype='datetime64[ns]').view(np.int64)
+    churn_timestamp = max(int(state['churn_timestamp']), int(timestamps.max()))
+
+    # number the new players after the state ones, in order of first event
+    known_players = len(state['player_ids'])
+    new_ids = pd.unique(game_events[PlayerEventField.player_id.name][
+        pd.Index(state['player_ids']).get_indexer(game_events[PlayerEventField.player_id.name]) < 0])
+    player_ids = np.concatenate((state['player_ids'], np.asarray(new_ids, dtype=state['player_ids'].dtype)))
+    players = pd.Index(player_ids).get_indexer(game_events[PlayerEventField.player_id.name])
+    updated_players = pd.unique(players)
+    updated = np.zeros(len(player_ids), dtype=bool)
+    updated[updated_players] = True
+
+    # featurize the updated players from their state events and new events
+    state_events = updated[state['events_players']]
+    state_players = state['events_players'][state_events]
+    state_player_types = player_features[FeatureName.player_type.name].to_numpy()[state_players]
+    event_types = pd.Index(state['event_types']).append(
+        pd.Index(game_events[PlayerEventField.event_type.name].astype('category').cat.categories)).unique()
+    updated_events = pd.DataFrame({
+        PlayerEventField.timestamp.name: np.concatenate((state['events_timestamps'][state_events], timestamps)).view('datetime64[ns]'),
+        PlayerEventField.player_id.name: np.concatenate((state_players, players)),
+        PlayerEventField.session_id.name: np.concatenate((state['events_sessions'][state_events], game_events[PlayerEventField.session_id.name].to_numpy())),
+        PlayerEventField.event_type.name: pd.Categorical(np.concatenate((
+            state['event_types'][state['events_types'][state_events]],
+            game_events[PlayerEventField.event_type.name].astype(str).to_numpy())), categories=event_types),
+        PlayerEventField.player_type.name: np.concatenate((
+            state_player_types, game_events[PlayerEventField.player_type.name].astype(str).to_numpy())),
+    })
+    updated_features = FEATURES_ENGINES[engine](updated_events, features_options, pd.Timestamp(churn_timestamp))
+
+    # the cohorts, lifetimes and session counts of the known players span the events of the state
+    first_timestamps = np.concatenate((state['first_timestamps'], np.full(len(new_ids), np.iinfo(np.int64).max)))
+    np.minimum.at(first_timestamps, players, timestamps)
+    last_timestamps = np.concatenate((state['last_timestamps'], np.full(len(new_ids), np.iinfo(np.int64).min)))
+    np.maximum.at(last_timestamps, players, timestamps)
+
+    known = updated_features.index.to_numpy() < known_players
+    known_players_codes = updated_features.index.to_numpy()[known]
+    state_sessions = pd.DataFrame({'player': state_players, 'session': state['events_sessions'][state_events]})
+    state_session_counts = state_sessions.drop_duplicates().groupby('player').size()
+    first_dates = pd.DatetimeIndex(first_timestamps[known_players_codes].view('datetime64[ns]'))
+    known_features = updated_features[known].copy()
+    known_features[FeatureName.cohort_id.name] = first_dates.strftime('%Y_%m_%d').to_numpy()
+    known_features[FeatureName.cohort_day_of_week.name] = first_dates.day_of_week.to_numpy()
+    known_features[FeatureName.player_type.name] = player_features[FeatureName.player_type.name].to_numpy()[known_players_codes]
+    known_features[FeatureName.player_lifetime.name] = \
+        (last_timestamps[known_players_codes] - first_timestamps[known_players_codes]) / ONE_SECOND_IN_NANOSECONDS
+    known_features[FeatureName.session_count.name] = \
+        player_features[FeatureName.session_count.name].to_numpy()[known_players_codes] + \
+        known_features[FeatureName.session_count.name].to_numpy() - \
+        state_session_counts.reindex(known_players_codes, fill_value=0).to_numpy()
+
+    for column in known_features.columns:
+        values = player_features[column].to_numpy()
+        known_values = known_features[column].to_numpy()
+        values = values.astype(np.result_type(values.dtype, known_values.dtype))
+        values[known_players_codes] = known_values
+        player_features[column] = values
+    new_features = updated_features[~known].sort_index()
+    new_features.index = pd.Index(player_ids[new_features.index.to_numpy()], name=FeatureName.player_id.name)
+    player_features = pd.concat([player_features, new_features])
+    player_features[FeatureName.player_churn.name] = \
+        (churn_timestamp - last_timestamps) // ONE_DAY_IN_NANOSECONDS > churn_days
+
+    # keep the state events of the players without new events, and the events in the windows of the updated ones
+    events_players = np.concatenate((state['events_players'][~state_events], updated_events[PlayerEventField.player_id.name].to_numpy()))
+    events_timestamps = np.concatenate((state['events_timestamps'][~state_events], updated_events[PlayerEventField.timestamp.name].to_numpy().view(np.int64)))
+    events_sessions = np.concatenate((state['events_sessions'][~state_events], updated_events[PlayerEventField.session_id.name].to_numpy()))
+    events_types = np.concatenate((
+        pd.Index(event_types).get_indexer(state['event_types'])[state['events_types'][~state_events]],
+        updated_events[PlayerEventField.event_type.name].cat.codes.to_numpy()))
+    kept = prune_features_state_events(events_players, events_timestamps, events_sessions, last_timestamps, features_options)
+    state = {
+        **state,
+        'churn_timestamp': np.array(churn_timestamp),
+        'player_ids': player_ids,
+        'first_timestamps': first_timestamps,
+        'last_timestamps': last_timestamps,
+        'event_types': np.asarray(event_types, dtype=str),
+        'events_players': events_players[kept],
+        'events_timestamps': events_timestamps[kept],
+        'events_sessions': events_sessions[kept],
+        'events_types': events_types[kept],
+        **{f'features.{column}': player_features[column].to_numpy() for column in player_features.columns},
+    }
+    return player_features, state
+
+# the index level of the snapshots features holding the snapshot dates
+SNAPSHOT_FIELD = 'snapshot'
+
+SNAPSHOT_DATE_FORMAT = '%Y-%m-%d'
+
+def parse_snapshots(snapshots):
+    """Parse comma separated snapshot dates, a FIRST:LAST date range standing for all its days."""
+    dates = []
+    for snapshot in snapshots.split(','):
+        first, _, last = snapshot.strip().partition(':')
+        dates.extend(pd.date_range(first, last or first, freq='D'))
+    return sorted(set(dates))
+
+def generate_snapshots_player_features(game_events, features_options, engine, snapshots, features_writer):
+    """Generate the features of the players at each snapshot date, from their events before the snapshot date.
+
+    The features of a snapshot are the ones of the events before it, with the churn of their last event. The events are
+    sorted once and swept from one snapshot to the next: the features state of the first snapshot is updated with the
+    events of the next ones, so only the players with events since the previous snapshot are featurized again. The
+    features of each snapshot are written as soon as they are computed, with the snapshot date as first index level.
+    """
+    game_events[PlayerEventField.timestamp.name] = pd.to_datetime(game_events[PlayerEventField.timestamp.name])
+    game_events = game_events.sort_values(by=[PlayerEventField.timestamp.name], kind='stable').reset_index(drop=True)
+    timestamps = game_events[PlayerEventField.timestamp.name].to_numpy()
+    bounds = np.searchsorted(timestamps, np.array(snapshots, dtype=timestamps.dtype))
+
+    state = None
+    begin = 0
+    for snapshot, end in zip(snapshots, bounds):
+        if end > begin:
+            snapshot_events = game_events.iloc[begin:end].reset_index(drop=True)
+            if state is None:
+                player_features = FEATURES_ENGINES[engine](snapshot_events.copy(), features_options)
+                state = build_features_state(snapshot_events, player_features, features_options)
+            else:
+                player_features, state = update_player_features(state, snapshot_events, features_options, engine)
+            begin = end
+        if state is None:
+            print(f'no events before snapshot {snapshot.strftime(SNAPSHOT_DATE_FORMAT)}!')
+            continue
+
+        snapshot_features = batch_features_dtypes(player_features)
+        snapshot_features.index = pd.MultiIndex.from_arrays(
+            [np.full(len(snapshot_features), snapshot.strftime(SNAPSHOT_DATE_FORMAT)), snapshot_features.index],
+            names=[SNAPSHOT_FIELD, FeatureName.player_id.name])
+        features_writer.write(snapshot_features)
+        print(f'snapshot {snapshot.strftime(SNAPSHOT_DATE_FORMAT)} featurized!')
+
+def store_features(player_features, filename, storage_format, features_options, sparse=False):
+    """Write the features, the variants features being written as a sparse matrix beside the players ones when sparse."""
+    print('storing features...')
+    if sparse:
+        variants_columns = [
+            column for variant in features_options.variants for column in features_variant_columns(features_options, variant)
+        ]
+        matrix_path, manifest_path = sparse_features_paths(filename)
+        write_sparse_features(player_features[variants_columns], filename)
+        print(f'sparse features stored in {matrix_path} with columns manifest {manifest_path}!')
+        player_features = player_features.drop(columns=variants_columns)
+    write_features(player_features, filename, storage_format)
+    print(f'features stored in {storage_path(filename, storage_format)}!')
+
 def generate(filename, events, churn_days, last_minutes, last_hours, 
-             last_days, last_weeks, last_months, seed, overwrite, debug):
+             last_days, last_weeks, last_months, seed, overwrite, debug,
+             storage_format=StorageFormat.csv.name, events_format=StorageFormat.csv.name,
+             engine=FeaturesEngine.serial.name, workers=1, chunk_size=0, state=None, snapshots=None, variants=None,
+             sparse=False, windows=None):
     
     # set seed
 
@@ -253,17 +988,43 @@ def generate(filename, events, churn_days, last_minutes, last_hours,
 
     # load game events
 
-    print('loading events...')
-    events_file = f'{events}.csv'
+    if storage_format != StorageFormat.csv.name or events_format != StorageFormat.csv.name:
+        import_pyarrow()
+
+    events_file = storage_path(events, events_format)
     if not exists(events_file):
         print(f'{events_file} does not exist!')
         return
-    events_dataframe = pd.read_csv(events_file)
-    print('events loaded!')
+    if state is not None and chunk_size > 0:
+        print('the features state is built and updated from events loaded in memory, use --chunk-size 0!')
+        return
+    if variants is not None and not set(variants.split(',')) <= set(FeatureVariant.names()):
+        print(f'the features variants are {",".join(FeatureVariant.names())}!')
+        return
+    if sparse and (chunk_size > 0 or snapshots is not None):
+        print('the sparse features are written from features computed in memory, without chunks or snapshots!')
+        return
+    if snapshots is not None and (chunk_size > 0 or state is not None):
+        print('the snapshots features are computed from events loaded in memory, without features state!')
+        return
+    if windows is not None and (chunk_size > 0 or state is not None or snapshots is not None):
+        print('the windows features are computed from events loaded in memory, without chunks, state or snapshots!')
+        return
+    if windows is not None:
+        try:
+            windows = parse_windows(windows)
+        except ValueError as error:
+            print(f'{error}!')
+            return
+    if chunk_size == 0:
+        print('loading events...')
+        events_columns = FEATURES_EVENTS_FIELDS + ([WINDOW_VALUE_FIELD] if windows is not None else [])
+        events_dataframe = read_events(events, events_format, columns=events_columns)
+        print('events loaded!')
 
     # generate machine learning features
 
-    features_file = f'{filename}.csv'
+    features_file = storage_path(filename, storage_format)
     
     if not exists(features_file) or overwrite:
         
@@ -273,14 +1034,66 @@ def generate(filename, events, churn_days, last_minutes, last_hours,
             last_hours,
             last_days,
             last_weeks,
-            last_months
+            last_months,
+            variants.split(',') if variants is not None else None
         )
-        features_dataframe = generate_player_features(events_dataframe, features_options)
+        features_directory = os.path.dirname(os.path.abspath(features_file))
+        if chunk_size > 0:
+            print(f'streaming events in chunks of {chunk_size} events...')
+            features_writer = FeaturesWriter(filename, storage_format)
+            try:
+                with tempfile.TemporaryDirectory(prefix=f'.{os.path.basename(filename)}-shards-', dir=features_directory) as shards_directory:
+                    generate_chunked_player_features(
+                        events, events_format, features_options, engine, workers, chunk_size, shards_directory,
+                        features_writer)
+            finally:
+                features_writer.close()
+            if features_writer.rows > 0:
+                print(f'features stored in {features_file}!')
+            return
+
+        if snapshots is not None:
+            features_writer = FeaturesWriter(filename, storage_format)
+            try:
+                generate_snapshots_player_features(
+                    events_dataframe, features_options, engine, parse_snapshots(snapshots), features_writer)
+            finally:
+                features_writer.close()
+            if features_writer.rows > 0:
+                print(f'features stored in {features_file}!')
+            return
+
+        if state is not None and exists(state):
+            print(f'updating features state {state}...')
+            features_state = load_features_state(state)
+            state_options = [getattr(features_options, option) for option in FEATURES_STATE_OPTIONS]
+            if list(features_state['options']) != state_options or list(features_state['variants']) != features_options.variants:
+                print(f'{state} was built with other features options, remove it to build a new state!')
+                return
+            features_dataframe, features_state = update_player_features(
+                features_state, events_dataframe, features_options, engine)
+            save_features_state(features_state, state)
+            store_features(features_dataframe, filename, storage_format, features_options, sparse)
+            return
+
+        if workers > 1:
+            with tempfile.TemporaryDirectory(prefix=f'.{os.path.basename(filename)}-shards-', dir=features_directory) as shards_directory:
+                features_dataframe = generate_sharded_player_features(
+                    events_dataframe, features_options, engine, workers, shards_directory)
+        else:
+            features_dataframe = FEATURES_ENGINES[engine](events_dataframe, features_options)
+
+        if state is not None:
+            print(f'building features state {state}...')
+            save_features_state(build_features_state(events_dataframe, features_dataframe, features_options), state)
+
+        if windows is not None:
+            print('generating windows features...')
+            features_dataframe = pd.concat([
+                features_dataframe, generate_windows_player_features(events_dataframe, windows, features_dataframe.index)], axis=1)
 
-        print('storing features...')
-        features_dataframe.to_csv(features_file)
-        print(f'features stored in {features_file}!')
+        store_features(features_dataframe, filename, storage_format, features_options, sparse)
         
     else:
         
-        print(f'{features_file} already exists, use --overwrite to replace the current features!')
\ No newline at end of file
+        print(f'{features_file} already exists, use --overwrite to replace the current features!')
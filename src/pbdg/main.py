@@ -6,6 +6,8 @@ import click
 from pbdg.common import PlayerEventField, PlayerEventType
 import pbdg.events as e
 import pbdg.features as f
+import pbdg.metrics as m
+import pbdg.storage as s
 
 # events
 
@@ -14,10 +16,20 @@ DEFAULT_GAME_EVENTS_FILENAME=''
 DEFAULT_EVENTS_DATE=str(date.today())
 DEFAULT_EVENTS_PLAYERS=10
 DEFAULT_EVENTS_DAYS=7
+DEFAULT_EVENTS_ENGINE=e.GameEngine.serial.name
+DEFAULT_EVENTS_WORKERS=1
+DEFAULT_EVENTS_STREAM=False
+DEFAULT_EVENTS_FORMAT=s.StorageFormat.csv.name
+DEFAULT_EVENTS_ID_FORMAT=s.IdFormat.int.name
+DEFAULT_EVENTS_STAGES=False
 
 # metrics
 
 DEFAULT_METRICS_FILENAME='metrics'
+DEFAULT_METRICS_CHUNK_SIZE=1000000
+DEFAULT_METRICS_RETENTION_DAYS='1,7,30'
+DEFAULT_METRICS_CCU=False
+DEFAULT_METRICS_FORMAT=s.StorageFormat.csv.name
 
 # features
 
@@ -28,6 +40,15 @@ DEFAULT_FEATURES_LAST_HOURS=0
 DEFAULT_FEATURES_LAST_DAYS=7
 DEFAULT_FEATURES_LAST_WEEKS=3
 DEFAULT_FEATURES_LAST_MONTHS=2
+DEFAULT_FEATURES_ENGINE=f.FeaturesEngine.serial.name
+DEFAULT_FEATURES_WORKERS=1
+DEFAULT_FEATURES_CHUNK_SIZE=0
+DEFAULT_FEATURES_STATE=None
+DEFAULT_FEATURES_SNAPSHOTS=None
+DEFAULT_FEATURES_VARIANTS=','.join(f.FeatureVariant.names())
+DEFAULT_FEATURES_SPARSE=False
+DEFAULT_FEATURES_WINDOWS=None
+DEFAULT_FEATURES_FORMAT=s.StorageFormat.csv.name
 
 DEFAULT_HARDCORE=0.05
 DEFAULT_CASUAL=0.1
@@ -59,6 +80,12 @@ Generate game events of types ({','.join(PlayerEventType.names())}) with fields
 @click.option('--players', default=DEFAULT_EVENTS_PLAYERS, help=f'The number of daily acquired players (default={DEFAULT_EVENTS_PLAYERS})')
 @click.option('--days', default=DEFAULT_EVENTS_DAYS, help=f'The number of acquisition days (default={DEFAULT_EVENTS_DAYS})')
 @click.option('--seed', default=DEFAULT_SEED, help=f'The random seed (default={DEFAULT_SEED})')
+@click.option('--engine', type=click.Choice(e.GameEngine.names()), default=DEFAULT_EVENTS_ENGINE, help=f'The simulation engine, vectorized steps the players of each block of up to {e.PLAYERS_BLOCK_SIZE} players day by day with batched NumPy draws, scheduled only visits the players on the days they play (default={DEFAULT_EVENTS_ENGINE})')
+@click.option('--workers', default=DEFAULT_EVENTS_WORKERS, help=f'The number of worker processes simulating the cohorts in parallel (default={DEFAULT_EVENTS_WORKERS})')
+@click.option('--stream/--no-stream', default=DEFAULT_EVENTS_STREAM, help=f'The streaming flag, events are flushed to disk day by day to keep memory bounded (default={DEFAULT_EVENTS_STREAM})')
+@click.option('--format', 'storage_format', type=click.Choice(s.StorageFormat.names()), default=DEFAULT_EVENTS_FORMAT, help=f'The events file format, parquet and arrow write a dataset partitioned by event date (default={DEFAULT_EVENTS_FORMAT})')
+@click.option('--id-format', type=click.Choice(s.IdFormat.names()), default=DEFAULT_EVENTS_ID_FORMAT, help=f'The ids format, 64-bit integers or salted 128-bit hex strings or uuids (default={DEFAULT_EVENTS_ID_FORMAT})')
+@click.option('--stages/--no-stages', default=DEFAULT_EVENTS_STAGES, help=f'The stages flag, sessions generate BEGIN_STAGE and END_STAGE events with stage_id and stage_score fields (default={DEFAULT_EVENTS_STAGES})')
 @click.option('--plot/--no-plot', default=DEFAULT_PLOT, help=f'The plot flag (default={DEFAULT_PLOT})')
 @click.option('--overwrite/--no-overwrite', default=DEFAULT_PLOT, help=f'The overwrite flag (default={DEFAULT_OVERWRITE})')
 @click.option('--debug/--no-debug', default=DEFAULT_DEBUG, help=f'The debug flag (default={DEFAULT_DEBUG})')
@@ -70,18 +97,24 @@ Generate game events of types ({','.join(PlayerEventType.names())}) with fields
 @click.option('--noise_decay_rate', default=DEFAULT_NOISEDECAYRATE, help=f'The default noise decay rate of new users (default={DEFAULT_NOISEDECAYRATE})')
 @click.argument('filename', default=DEFAULT_EVENTS_FILENAME)
 @click.argument('game_events_filename', default=DEFAULT_GAME_EVENTS_FILENAME)
-def events(filename, game_events_filename, date, players, days, seed, plot, overwrite, debug, hardcore, casual, churner, decay_rate, noise_scale, noise_decay_rate):
-    e.generate(filename, game_events_filename, date, players, days, seed, plot, overwrite, debug, hardcore, casual, churner, decay_rate, noise_scale, noise_decay_rate)
+def events(filename, game_events_filename, date, players, days, seed, engine, workers, stream, storage_format, id_format, stages, plot, overwrite, debug, hardcore, casual, churner, decay_rate, noise_scale, noise_decay_rate):
+    e.generate(filename, game_events_filename, date, players, days, seed, plot, overwrite, debug, hardcore, casual, churner, decay_rate, noise_scale, noise_decay_rate, engine, workers, stream, storage_format, id_format, stages)
 
 @main.command(help=f'''
-Generate metrics from game events (not implemented yet)
+Generate daily metrics ({','.join(m.DailyMetric.names())}) and cohorts metrics ({','.join(m.CohortMetric.names())},retention) by platform from game events in specified filenames (default={DEFAULT_METRICS_FILENAME}_daily,{DEFAULT_METRICS_FILENAME}_cohorts)
 ''')
 @click.option('--seed', default=DEFAULT_SEED, help=f'The random seed (default={DEFAULT_SEED})')
+@click.option('--overwrite/--no-overwrite', default=DEFAULT_OVERWRITE, help=f'The overwrite flag (default={DEFAULT_OVERWRITE})')
 @click.option('--debug/--no-debug', default=DEFAULT_DEBUG, help=f'The debug flag (default={DEFAULT_DEBUG})')
-@click.option('--events', default=DEFAULT_EVENTS_FILENAME, help=f'The csv filename of the input game events (default={DEFAULT_EVENTS_FILENAME})')
+@click.option('--events', default=DEFAULT_EVENTS_FILENAME, help=f'The filename of the input game events (default={DEFAULT_EVENTS_FILENAME})')
+@click.option('--events-format', type=click.Choice(s.StorageFormat.names()), default=DEFAULT_EVENTS_FORMAT, help=f'The input game events format (default={DEFAULT_EVENTS_FORMAT})')
+@click.option('--chunk-size', default=DEFAULT_METRICS_CHUNK_SIZE, help=f'The number of events read at once, the events being aggregated in a single pass with memory bounded by the open days and the players cohorts (default={DEFAULT_METRICS_CHUNK_SIZE})')
+@click.option('--retention-days', default=DEFAULT_METRICS_RETENTION_DAYS, help=f'The comma separated days after their first day the cohorts retention is computed for (default={DEFAULT_METRICS_RETENTION_DAYS})')
+@click.option('--ccu/--no-ccu', default=DEFAULT_METRICS_CCU, help=f'The CCU flag, the peak concurrent users of each minute, for all the platforms and by platform, are written in a {DEFAULT_METRICS_FILENAME}_ccu file (default={DEFAULT_METRICS_CCU})')
+@click.option('--format', 'storage_format', type=click.Choice(s.StorageFormat.names()), default=DEFAULT_METRICS_FORMAT, help=f'The metrics files format (default={DEFAULT_METRICS_FORMAT})')
 @click.argument('filename', default=DEFAULT_METRICS_FILENAME)
-def metrics(filename, events, seed, debug):
-    click.echo('not implemented yet!')
+def metrics(filename, events, events_format, chunk_size, retention_days, ccu, storage_format, seed, overwrite, debug):
+    m.generate(filename, events, seed, overwrite, debug, storage_format, events_format, chunk_size, retention_days, ccu)
 
 @main.command(help=f'''
 Generate machine learning features ({','.join(f.FeatureName.names())}) with variants ({','.join(f.FeatureVariant.names())}) for each event type ({','.join(f.PlayerEventType.names())}) in a specified csv filename (default={DEFAULT_FEATURES_FILENAME})
@@ -92,25 +125,37 @@ Generate machine learning features ({','.join(f.FeatureName.names())}) with vari
 @click.option('--last-days', default=DEFAULT_FEATURES_LAST_DAYS, help=f'The number of days to sample before last event date (default={DEFAULT_FEATURES_LAST_DAYS})')
 @click.option('--last-weeks', default=DEFAULT_FEATURES_LAST_WEEKS, help=f'The number of minutes to sample before last event date (default={DEFAULT_FEATURES_LAST_WEEKS})')
 @click.option('--last-months', default=DEFAULT_FEATURES_LAST_MONTHS, help=f'The number of months to sample before last event date (default={DEFAULT_FEATURES_LAST_MONTHS})')
-@click.option('--events', default=DEFAULT_EVENTS_FILENAME, help=f'The csv filename of the input game events (default={DEFAULT_EVENTS_FILENAME})')
+@click.option('--variants', default=DEFAULT_FEATURES_VARIANTS, help=f'The comma separated features variants computed for the sampled time periods (default={DEFAULT_FEATURES_VARIANTS})')
+@click.option('--windows', default=DEFAULT_FEATURES_WINDOWS, help=f'The comma separated DURATION[:STRIDE[:COUNT]] windows (durations in s, m, h, d or w, e.g. 90m or 1h:15m:4) ending every stride before the last event, with the events counts and item values sum of each window (default={DEFAULT_FEATURES_WINDOWS})')
+@click.option('--events', default=DEFAULT_EVENTS_FILENAME, help=f'The filename of the input game events (default={DEFAULT_EVENTS_FILENAME})')
+@click.option('--events-format', type=click.Choice(s.StorageFormat.names()), default=DEFAULT_EVENTS_FORMAT, help=f'The format of the input game events (default={DEFAULT_EVENTS_FORMAT})')
+@click.option('--engine', type=click.Choice(f.FeaturesEngine.names()), default=DEFAULT_FEATURES_ENGINE, help=f'The features engine, vectorized computes the features of all players at once with NumPy (default={DEFAULT_FEATURES_ENGINE})')
+@click.option('--workers', default=DEFAULT_FEATURES_WORKERS, help=f'The number of worker processes computing the features of players shards in parallel (default={DEFAULT_FEATURES_WORKERS})')
+@click.option('--chunk-size', default=DEFAULT_FEATURES_CHUNK_SIZE, help=f'The number of events read at once to featurize events larger than memory, 0 loads all the events (default={DEFAULT_FEATURES_CHUNK_SIZE})')
+@click.option('--state', default=DEFAULT_FEATURES_STATE, help=f'The features state file (.npz) built with the features, when it exists only the players of the events are featurized again (default={DEFAULT_FEATURES_STATE})')
+@click.option('--snapshots', default=DEFAULT_FEATURES_SNAPSHOTS, help=f'The comma separated snapshot dates (YYYY-MM-DD, or FIRST:LAST for all the days of a range) to compute the features of the events before each of them in a single file (default={DEFAULT_FEATURES_SNAPSHOTS})')
+@click.option('--sparse/--no-sparse', default=DEFAULT_FEATURES_SPARSE, help=f'Write the variants features as a CSR matrix (<filename>.npz) with a columns manifest (<filename>.columns.json), the features file only holding the players features (default={DEFAULT_FEATURES_SPARSE})')
+@click.option('--format', 'storage_format', type=click.Choice(s.StorageFormat.names()), default=DEFAULT_FEATURES_FORMAT, help=f'The features file format (default={DEFAULT_FEATURES_FORMAT})')
 @click.option('--seed', default=DEFAULT_SEED, help=f'The random seed (default={DEFAULT_SEED})')
 @click.option('--overwrite/--no-overwrite', default=DEFAULT_PLOT, help=f'The overwrite flag (default={DEFAULT_OVERWRITE})')
 @click.option('--debug/--no-debug', default=DEFAULT_DEBUG, help=f'The debug flag (default={DEFAULT_DEBUG})')
 @click.argument('filename', default=DEFAULT_FEATURES_FILENAME)
-def features(filename, events, churn_days, last_minutes, last_hours, 
-                last_days, last_weeks, last_months, 
+def features(filename, events, events_format, engine, workers, chunk_size, state, snapshots, sparse, storage_format, churn_days, last_minutes, last_hours, 
+                last_days, last_weeks, last_months, variants, windows,
                 seed, overwrite, debug):
     f.generate(filename, events, churn_days, last_minutes, last_hours, 
                 last_days, last_weeks, last_months, 
-                seed, overwrite, debug)
+                seed, overwrite, debug, storage_format, events_format, engine, workers, chunk_size, state, snapshots, variants, sparse, windows)
     
 @main.command(help=f'''
 Simulate
 ''')
+@click.option('--format', 'storage_format', type=click.Choice(s.StorageFormat.names()), default=DEFAULT_EVENTS_FORMAT, help=f'The simulated events files format (default={DEFAULT_EVENTS_FORMAT})')
+@click.option('--id-format', type=click.Choice(s.IdFormat.names()), default=DEFAULT_EVENTS_ID_FORMAT, help=f'The ids format of the simulated events (default={DEFAULT_EVENTS_ID_FORMAT})')
 @click.argument('filename', default=DEFAULT_SIMULATE_FILENAME)
 @click.argument('game_events_filename', default=DEFAULT_GAME_EVENTS_FILENAME)
-def simulate(filename, game_events_filename):
-    e.simulate(filename, game_events_filename)
+def simulate(filename, game_events_filename, storage_format, id_format):
+    e.simulate(filename, game_events_filename, storage_format, id_format)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
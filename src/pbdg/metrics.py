@@ -0,0 +1,434 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import random
+from os.path import exists
+import numpy as np
+import pandas as pd
+from enum import Enum
+from pbdg.common import *
+from pbdg.storage import StorageFormat, FeaturesWriter, import_pyarrow, read_events_batches, storage_path, write_features
+from pbdg.features import ONE_MINUTE_IN_SECONDS, ONE_SECOND_IN_NANOSECONDS, ONE_DAY_IN_NANOSECONDS
+
+ONE_MINUTE_IN_NANOSECONDS = ONE_MINUTE_IN_SECONDS * ONE_SECOND_IN_NANOSECONDS
+ONE_DAY_IN_MINUTES = ONE_DAY_IN_NANOSECONDS // ONE_MINUTE_IN_NANOSECONDS
+
+# the events columns read by the metrics
+METRICS_EVENTS_FIELDS = [
+    PlayerEventField.timestamp.name,
+    PlayerEventField.event_type.name,
+    PlayerEventField.player_id.name,
+    PlayerEventField.platform_type.name,
+    PlayerEventField.session_id.name,
+    PlayerEventField.item_value.name,
+]
+
+# the platform of the metrics of all the platforms
+ALL_PLATFORMS = 'ALL'
+
+class DailyMetric(Enum):
+    active_players = 0
+    new_players = 1
+    sessions = 2
+    session_duration_mean = 3
+    revenue = 4
+    paying_players = 5
+    arpdau = 6
+    arppu = 7
+    peak_ccu = 8
+
+    @classmethod
+    def names(cls):
+        return list(map(lambda e: e.name, cls))
+
+class CohortMetric(Enum):
+    players = 0
+    revenue = 1
+    paying_players = 2
+    arpu = 3
+    arppu = 4
+
+    @classmethod
+    def names(cls):
+        return list(map(lambda e: e.name, cls))
+
+    @classmethod
+    def retention(cls, day):
+        return f'retention_d{day}'
+
+# the sums of the events of a day, by platform
+NEW_PLAYERS, SESSIONS, DURATIONS_SUM, DURATIONS, REVENUE = range(5)
+
+# the sums of the players of a cohort, by platform, followed by the retained players of each retention day
+COHORT_PLAYERS, COHORT_REVENUE, COHORT_PAYING_PLAYERS, COHORT_RETAINED = range(4)
+
+def enum_indices(values, enum):
+    """Return the indices in the enum of categorical values, the unknown values having the index after the last one."""
+    values = values.astype('category').cat
+    names = enum.names()
+    indices = np.array([names.index(name) if name in names else len(names) for name in values.categories] + [len(names)])
+    return indices[values.codes.to_numpy()]
+
+class MetricsAggregator:
+    """Aggregate the daily and cohort metrics of time sorted events batches in a single pass.
+
+    The additive metrics (new players, sessions, durations, revenue) are summed by day and platform as the batches come.
+    The distinct active and paying players of a day are only kept until a batch starts after this day: the day is then
+    closed, its distinct players counted and the retention of their cohorts incremented. The cohort of a player is the
+    day and platform of its first event, the players cohorts and the paying players being the only state kept for the
+    whole pass. The sessions durations pair the BEGIN_SESSION and END_SESSION events of a session across the batches,
+    only the sessions still going on being kept.
+
+    The concurrent users (CCU) are swept along the events: a player is counted from the BEGIN_SESSION event opening its
+    first open session to the END_SESSION event closing its last one, the sessions ended before they began being left
+    out, so the overlapping sessions of a player count once. The platform of a player is the one of its cohort. The CCU
+    of a minute is the peak of the concurrent users during this minute, the minutes being written to the ccu_writer if
+    any, and the CCU of the last minute being kept until a batch starts after it. Only the open sessions counts of the
+    players having open sessions are kept between the batches.
+    """
+
+    def __init__(self, retention_days, ccu_writer=None):
+        self.retention_days = retention_days
+        self.platforms = len(PlatformType) + 1
+        self.daily_sums = dict()
+        self.daily_players = dict()
+        self.open_days = dict()
+        self.last_timestamp = np.iinfo(np.int64).min
+        self.cohorts_sums = dict()
+        self.player_cohorts = dict()
+        self.player_platforms = dict()
+        self.paying_players = set()
+        self.events = 0
+        self.begins = pd.DataFrame({'session': [], 'begin': np.array([], dtype=np.int64), 'platform': np.array([], dtype=np.int64),
+                                    'order': np.array([], dtype=np.int64)})
+        self.ends = pd.DataFrame({'session': [], 'end': np.array([], dtype=np.int64), 'order': np.array([], dtype=np.int64)})
+        self.ccu_writer = ccu_writer
+        self.open_sessions = dict()
+        self.concurrent_users = np.zeros(self.platforms + 1, dtype=np.int64)
+        self.ccu_minute = None
+        self.ccu_peaks = None
+        self.daily_ccu_peaks = dict()
+
+    def add_daily(self, metric, days, platforms, values=1):
+        values = np.broadcast_to(values, days.shape)
+        for day in np.unique(days):
+            if day not in self.daily_sums:
+                self.daily_sums[day] = np.zeros((REVENUE + 1, self.platforms))
+            mask = days == day
+            np.add.at(self.daily_sums[day][metric], platforms[mask], values[mask])
+
+    def add_cohorts(self, metric, cohorts, platforms, values=1):
+        values = np.broadcast_to(values, cohorts.shape)
+        for cohort in np.unique(cohorts):
+            if cohort not in self.cohorts_sums:
+                self.cohorts_sums[cohort] = np.zeros((COHORT_RETAINED + len(self.retention_days), self.platforms))
+            mask = cohorts == cohort
+            np.add.at(self.cohorts_sums[cohort][metric], platforms[mask], values[mask])
+
+    def add(self, events):
+        timestamps = pd.to_datetime(events[PlayerEventField.timestamp.name]).to_numpy(dtype='datetime64[ns]').view(np.int64)
+        days = timestamps // ONE_DAY_IN_NANOSECONDS
+        if timestamps[0] < self.last_timestamp or np.any(np.diff(timestamps) < 0):
+            raise ValueError('the events are not sorted by time')
+        self.last_timestamp = timestamps[-1]
+        platforms = enum_indices(events[PlayerEventField.platform_type.name], PlatformType)
+        event_types = enum_indices(events[PlayerEventField.event_type.name], PlayerEventType)
+        player_ids = events[PlayerEventField.player_id.name]
+        values = np.nan_to_num(events[PlayerEventField.item_value.name].to_numpy(dtype=np.float64, na_value=np.nan))
+
+        # the new players join the cohort of the day and platform of their first event
+        new_players = player_ids.map(self.player_cohorts).isna().to_numpy()
+        if new_players.any():
+            firsts = np.flatnonzero(new_players)[~player_ids[new_players].duplicated().to_numpy()]
+            new_ids = player_ids.to_numpy()[firsts]
+            self.player_cohorts.update(zip(new_ids, days[firsts]))
+            self.player_platforms.update(zip(new_ids, platforms[firsts]))
+            self.add_cohorts(COHORT_PLAYERS, days[firsts], platforms[firsts])
+        cohorts = player_ids.map(self.player_cohorts).to_numpy(dtype=np.int64)
+        cohort_platforms = player_ids.map(self.player_platforms).to_numpy(dtype=np.int64)
+
+        registrations = event_types == PlayerEventType.names().index(PlayerEventType.USER_REGISTRATION.name)
+        self.add_daily(NEW_PLAYERS, days[registrations], platforms[registrations])
+        begins = event_types == PlayerEventType.names().index(PlayerEventType.BEGIN_SESSION.name)
+        self.add_daily(SESSIONS, days[begins], platforms[begins])
+        transactions = event_types == PlayerEventType.names().index(PlayerEventType.IAP_TRANSACTION.name)
+        self.add_daily(REVENUE, days[transactions], platforms[transactions], values[transactions])
+        self.add_cohorts(COHORT_REVENUE, cohorts[transactions], cohort_platforms[transactions], values[transactions])
+
+        new_paying_players = pd.unique(player_ids[transactions])
+        new_paying_players = [player for player in new_paying_players if player not in self.paying_players]
+        if len(new_paying_players) > 0:
+            self.paying_players.update(new_paying_players)
+            self.add_cohorts(COHORT_PAYING_PLAYERS,
+                             np.array([self.player_cohorts[player] for player in new_paying_players], dtype=np.int64),
+                             np.array([self.player_platforms[player] for player in new_paying_players], dtype=np.int64))
+
+        # the sessions ended in the batch are paired with their beginning, in this batch or a previous one, the sessions
+        # whose END_SESSION event comes before their BEGIN_SESSION one being left out
+        ends = event_types == PlayerEventType.names().index(PlayerEventType.END_SESSION.name)
+        session_ids = events[PlayerEventField.session_id.name].to_numpy()
+        orders = self.events + np.arange(len(events))
+        self.begins = pd.concat([self.begins, pd.DataFrame({
+            'session': session_ids[begins], 'begin': timestamps[begins], 'platform': platforms[begins], 'order': orders[begins],
+        })], ignore_index=True)
+        self.ends = pd.concat([self.ends, pd.DataFrame({
+            'session': session_ids[ends], 'end': timestamps[ends], 'order': orders[ends],
+        })], ignore_index=True)
+        sessions = self.ends.merge(self.begins, on='session', suffixes=('_end', '_begin'))
+        ended = sessions[sessions['order_end'] > sessions['order_begin']]
+        if len(ended) > 0:
+            self.add_daily(DURATIONS_SUM, ended['end'].to_numpy() // ONE_DAY_IN_NANOSECONDS, ended['platform'].to_numpy(),
+                           (ended['end'].to_numpy() - ended['begin'].to_numpy()) / ONE_SECOND_IN_NANOSECONDS)
+            self.add_daily(DURATIONS, ended['end'].to_numpy() // ONE_DAY_IN_NANOSECONDS, ended['platform'].to_numpy())
+        if len(sessions) > 0:
+            self.begins = self.begins[~self.begins['session'].isin(sessions['session'])]
+            self.ends = self.ends[~self.ends['session'].isin(sessions['session'])]
+
+        # the ended sessions began before the batch or in it, the ones ended before they began only begin in it
+        reversed_sessions = sessions.loc[sessions['order_end'] < sessions['order_begin'], 'session']
+        begins &= ~pd.Series(session_ids).isin(reversed_sessions).to_numpy()
+        positions = np.concatenate([np.flatnonzero(begins), ended['order_end'].to_numpy() - self.events])
+        order = np.argsort(positions, kind='stable')
+        positions = positions[order]
+        sessions_players = player_ids.to_numpy()[positions]
+        users_deltas = self.users_deltas(sessions_players, np.concatenate([
+            np.ones(begins.sum(), dtype=np.int64), -np.ones(len(ended), dtype=np.int64)])[order])
+        users = users_deltas != 0
+        self.sweep_users(timestamps, positions[users],
+                         pd.Series(sessions_players[users]).map(self.player_platforms).to_numpy(dtype=np.int64),
+                         users_deltas[users])
+        self.events += len(events)
+
+        # the distinct players of the days, the days before this batch being complete
+        players = pd.DataFrame({
+            'day': days, 'platform': platforms, 'player': player_ids.to_numpy(), 'paying': transactions,
+        }).drop_duplicates()
+        for day, day_players in players.groupby('day'):
+            self.open_days.setdefault(day, []).append(day_players[['platform', 'player', 'paying']])
+        for day in sorted(self.open_days):
+            if day < days.min():
+                self.close_day(day)
+
+    def users_deltas(self, players, deltas):
+        """Return the concurrent users deltas of the open sessions deltas of the players, in events order.
+
+        A player delta is +1 when its open sessions count goes from 0 to 1, -1 when it goes back to 0, and 0 otherwise.
+        """
+        if len(players) == 0:
+            return deltas
+        codes, uniques = pd.factorize(players)
+        order = np.argsort(codes, kind='stable')
+        sorted_codes, sorted_deltas = codes[order], deltas[order]
+        starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+        lengths = np.diff(np.r_[starts, len(order)])
+        open_sessions = pd.Series(uniques).map(self.open_sessions).fillna(0).to_numpy(dtype=np.int64)
+        cumulated_deltas = np.cumsum(sorted_deltas)
+        after = cumulated_deltas - np.repeat((cumulated_deltas - sorted_deltas)[starts], lengths) + open_sessions[sorted_codes]
+        before = after - sorted_deltas
+        users_deltas = np.zeros(len(order), dtype=np.int64)
+        users_deltas[order] = ((before == 0) & (after > 0)).astype(np.int64) - ((before > 0) & (after == 0))
+        for player, count in zip(uniques, after[np.r_[starts[1:], len(order)] - 1]):
+            if count > 0:
+                self.open_sessions[player] = count
+            else:
+                self.open_sessions.pop(player, None)
+        return users_deltas
+
+    def sweep_users(self, timestamps, positions, platforms, deltas):
+        """Sweep the concurrent users deltas at the positions of the batch events, by platform and for all of them."""
+        if len(positions) == 0:
+            return
+        steps = np.zeros((len(positions), self.platforms + 1), dtype=np.int64)
+        steps[np.arange(len(positions)), platforms] = deltas
+        steps[:, -1] = deltas
+        concurrent_users = self.concurrent_users + np.cumsum(steps, axis=0)
+
+        # the peak of a minute is the one of its events or the concurrent users at its start
+        minutes = timestamps[positions] // ONE_MINUTE_IN_NANOSECONDS
+        starts = np.flatnonzero(np.r_[True, minutes[1:] != minutes[:-1]])
+        peaks = np.maximum(np.maximum.reduceat(concurrent_users, starts, axis=0),
+                           np.vstack([self.concurrent_users, concurrent_users[:-1]])[starts])
+        lasts = concurrent_users[np.r_[starts[1:], len(positions)] - 1]
+        minutes = minutes[starts]
+        if self.ccu_minute == minutes[0]:
+            peaks[0] = np.maximum(peaks[0], self.ccu_peaks)
+        elif self.ccu_minute is not None:
+            minutes = np.r_[self.ccu_minute, minutes]
+            peaks = np.vstack([self.ccu_peaks, peaks])
+            lasts = np.vstack([self.concurrent_users, lasts])
+        self.concurrent_users = concurrent_users[-1]
+
+        # the minutes without events keep the concurrent users at the end of the minute before
+        all_minutes = np.arange(minutes[0], minutes[-1] + 1)
+        previous = np.searchsorted(minutes, all_minutes, side='right') - 1
+        ccu = np.where((minutes[previous] == all_minutes)[:, None], peaks[previous], lasts[previous])
+        self.write_ccu(all_minutes[:-1], ccu[:-1])
+        self.ccu_minute, self.ccu_peaks = all_minutes[-1], ccu[-1]
+
+    def write_ccu(self, minutes, ccu):
+        if len(minutes) == 0:
+            return
+        days = minutes // ONE_DAY_IN_MINUTES
+        starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+        for day, peaks in zip(days[starts], np.maximum.reduceat(ccu, starts, axis=0)):
+            self.daily_ccu_peaks[day] = np.maximum(self.daily_ccu_peaks.get(day, peaks), peaks)
+        if self.ccu_writer is not None:
+            self.ccu_writer.write(pd.DataFrame(
+                ccu[:, [-1] + list(range(len(PlatformType)))], columns=[ALL_PLATFORMS] + PlatformType.names(),
+                index=pd.DatetimeIndex(minutes * ONE_MINUTE_IN_NANOSECONDS, name='minute')))
+
+    def close_day(self, day):
+        players = pd.concat(self.open_days.pop(day)).drop_duplicates()
+        paying = players[players['paying']]
+        self.daily_players[day] = np.array([
+            np.append(np.bincount(players[['platform', 'player']].drop_duplicates()['platform'], minlength=self.platforms),
+                      players['player'].nunique()),
+            np.append(np.bincount(paying[['platform', 'player']].drop_duplicates()['platform'], minlength=self.platforms),
+                      paying['player'].nunique()),
+        ])
+
+        # the players active on the retention days of their cohort
+        active_players = pd.Series(pd.unique(players['player']))
+        cohorts = active_players.map(self.player_cohorts).to_numpy(dtype=np.int64)
+        cohort_platforms = active_players.map(self.player_platforms).to_numpy(dtype=np.int64)
+        for retention, retention_day in enumerate(self.retention_days):
+            retained = day - cohorts == retention_day
+            self.add_cohorts(COHORT_RETAINED + retention, cohorts[retained], cohort_platforms[retained])
+
+    def close(self):
+        for day in sorted(self.open_days):
+            self.close_day(day)
+        if self.ccu_minute is not None:
+            self.write_ccu(np.array([self.ccu_minute]), self.ccu_peaks[None, :])
+            self.ccu_minute = None
+
+    def platforms_rows(self, sums, active):
+        """Return the platforms rows of per platform sums: all the platforms, then each active known platform."""
+        rows = [(ALL_PLATFORMS, sums.sum(axis=-1))]
+        for platform, name in enumerate(PlatformType.names()):
+            if active[platform] > 0:
+                rows.append((name, sums[..., platform]))
+        return rows
+
+    def daily_metrics(self):
+        rows = []
+        index = []
+        for day in sorted(self.daily_players):
+            sums = self.daily_sums.get(day, np.zeros((REVENUE + 1, self.platforms)))
+            active_players, paying_players = self.daily_players[day]
+            peak_ccu = self.daily_ccu_peaks.get(day, np.zeros(self.platforms + 1, dtype=np.int64))
+            date = str(np.datetime64(int(day), 'D'))
+            for name, platform_sums in self.platforms_rows(sums, active_players[:-1]):
+                player_index = -1 if name == ALL_PLATFORMS else PlatformType.names().index(name)
+                active, paying = active_players[player_index], paying_players[player_index]
+                index.append((date, name))
+                rows.append([
+                    active,
+                    platform_sums[NEW_PLAYERS],
+                    platform_sums[SESSIONS],
+                    platform_sums[DURATIONS_SUM] / platform_sums[DURATIONS] if platform_sums[DURATIONS] > 0 else np.nan,
+                    platform_sums[REVENUE],
+                    paying,
+                    platform_sums[REVENUE] / active if active > 0 else np.nan,
+                    platform_sums[REVENUE] / paying if paying > 0 else np.nan,
+                    peak_ccu[player_index],
+                ])
+        metrics = pd.DataFrame(rows, columns=DailyMetric.names(),
+                               index=pd.MultiIndex.from_tuples(index, names=['date', PlayerEventField.platform_type.name]))
+        return metrics.astype({
+            name: np.int64 for name in [DailyMetric.active_players.name, DailyMetric.new_players.name,
+                                        DailyMetric.sessions.name, DailyMetric.paying_players.name, DailyMetric.peak_ccu.name]
+        })
+
+    def cohorts_metrics(self):
+        rows = []
+        index = []
+        last_day = max(self.daily_players) if len(self.daily_players) > 0 else None
+        for cohort in sorted(self.cohorts_sums):
+            sums = self.cohorts_sums[cohort]
+            date = str(np.datetime64(int(cohort), 'D'))
+            for name, platform_sums in self.platforms_rows(sums, sums[COHORT_PLAYERS]):
+                players = platform_sums[COHORT_PLAYERS]
+                index.append((date, name))
+                rows.append([
+                    players,
+                    platform_sums[COHORT_REVENUE],
+                    platform_sums[COHORT_PAYING_PLAYERS],
+                    platform_sums[COHORT_REVENUE] / players,
+                    platform_sums[COHORT_REVENUE] / platform_sums[COHORT_PAYING_PLAYERS] if platform_sums[COHORT_PAYING_PLAYERS] > 0 else np.nan,
+                ] + [
+                    # the retention days after the events are unknown
+                    platform_sums[COHORT_RETAINED + retention] / players if cohort + retention_day <= last_day else np.nan
+                    for retention, retention_day in enumerate(self.retention_days)
+                ])
+        metrics = pd.DataFrame(rows, columns=CohortMetric.names() + [CohortMetric.retention(day) for day in self.retention_days],
+                               index=pd.MultiIndex.from_tuples(index, names=['cohort', PlayerEventField.platform_type.name]))
+        return metrics.astype({name: np.int64 for name in [CohortMetric.players.name, CohortMetric.paying_players.name]})
+
+def generate_metrics(events, events_format, retention_days, chunk_size, ccu_writer=None):
+    """Return the daily and cohorts metrics of the events, read in a single pass by chunks of chunk_size events.
+
+    The CCU of each minute are written to the ccu_writer if any.
+    """
+    aggregator = MetricsAggregator(retention_days, ccu_writer)
+    chunks = 0
+    for chunk in read_events_batches(events, events_format, METRICS_EVENTS_FIELDS, chunk_size):
+        if len(chunk) == 0:
+            continue
+        aggregator.add(chunk)
+        chunks += 1
+        print(f'{chunks} events chunks aggregated...', end='\r')
+    print()
+    aggregator.close()
+    return aggregator.daily_metrics(), aggregator.cohorts_metrics()
+
+def metrics_filenames(filename):
+    return f'{filename}_daily', f'{filename}_cohorts', f'{filename}_ccu'
+
+def generate(filename, events, seed, overwrite, debug, storage_format=StorageFormat.csv.name,
+             events_format=StorageFormat.csv.name, chunk_size=1000000, retention_days='1,7,30', ccu=False):
+
+    # set seed
+
+    random.seed(seed)
+
+    if storage_format != StorageFormat.csv.name or events_format != StorageFormat.csv.name:
+        import_pyarrow()
+
+    events_file = storage_path(events, events_format)
+    if not exists(events_file):
+        print(f'{events_file} does not exist!')
+        return
+
+    daily_filename, cohorts_filename, ccu_filename = metrics_filenames(filename)
+    daily_file = storage_path(daily_filename, storage_format)
+    cohorts_file = storage_path(cohorts_filename, storage_format)
+    ccu_file = storage_path(ccu_filename, storage_format)
+
+    if (not exists(daily_file) and not exists(cohorts_file)) or overwrite:
+
+        print('aggregating metrics...')
+        ccu_writer = FeaturesWriter(ccu_filename, storage_format) if ccu else None
+        try:
+            daily_metrics, cohorts_metrics = generate_metrics(
+                events, events_format, [int(day) for day in retention_days.split(',')], chunk_size, ccu_writer)
+        except ValueError as error:
+            print(f'{error}!')
+            return
+        finally:
+            if ccu_writer is not None:
+                ccu_writer.close()
+        if len(daily_metrics) == 0:
+            print('no events to aggregate!')
+            return
+
+        print('storing metrics...')
+        write_features(daily_metrics, daily_filename, storage_format)
+        write_features(cohorts_metrics, cohorts_filename, storage_format)
+        print(f'metrics stored in {daily_file} and {cohorts_file}!')
+        if ccu_writer is not None:
+            print(f'{ccu_writer.rows} minutes CCU stored in {ccu_file}!')
+
+    else:
+
+        print(f'{daily_file} or {cohorts_file} already exist, use --overwrite to replace the current metrics!')
@@ -2,18 +2,22 @@
 # SPDX-License-Identifier: MIT-0
 
 import random
+import bisect
 from datetime import timedelta
 import numpy as np
 from pbdg.common import *
 
-def random_gauss_clamp(mu, sigma, factor=3):
-    return min(mu+factor*sigma, max(mu-factor*sigma, random.gauss(mu, sigma)))
+# the sampling helpers draw from a numpy.random.Generator (or the numpy.random module), mu and sigma being numbers or
+# arrays broadcast with size
 
-def random_time(mu, sigma):
-    return timedelta(seconds=random.gauss(mu.total_seconds(), sigma.total_seconds()))
+def sample_gauss(mu, sigma, size=None, rng=np.random):
+    return rng.normal(mu, sigma, size)
 
-def random_duration_clamp(mu, sigma, factor=2):
-    return timedelta(seconds=random_gauss_clamp(mu.total_seconds(), sigma.total_seconds(), factor))
+def sample_gauss_clamp(mu, sigma, factor=3, size=None, rng=np.random):
+    return np.clip(rng.normal(mu, sigma, size), mu - factor * sigma, mu + factor * sigma)
+
+def sample_count(mu, sigma, size=None, rng=np.random):
+    return np.maximum(0, rng.normal(mu, sigma, size)).astype(np.int64)
 
 class LinearInterpolator:
     '''A class to interpolate a number from a list of numbers.
@@ -28,25 +32,47 @@ class LinearInterpolator:
        value = wdict[1] # value == 10
        value = wdict[3] # value == 15
        value = wdict[40] # value == 100
+       values = linterp.compile(40)[np.arange(3)] # values == [10, 10, 12]
     '''
 
     def __init__(self, dictionary, mod = False):
         self.keys = []
         self.values = []
         self.mod = mod
+        self.table = np.empty(0)
 
         for key in dictionary:
             self.keys.append(float(key))
             self.values.append(float(dictionary[key]))
 
     def __getitem__(self, key):
-        mod_key = key
-        if mod_key > self.keys[-1] and self.mod:
-            mod_key = key % self.keys[-1]
+        table = self.table
+        if isinstance(key, (int, np.integer)):
+            if 0 <= key < len(table):
+                return table[key]
+        elif isinstance(key, np.ndarray) and key.dtype.kind in 'iu' and key.size > 0:
+            if 0 <= key.min() and key.max() < len(table):
+                return table[key]
+        return self.interpolate(key)
+
+    def interpolate(self, key):
+        """Interpolate a key or an array of keys, wrapping the keys above the last one when mod is set."""
+        if self.mod:
+            if np.ndim(key) == 0:
+                if key > self.keys[-1]:
+                    key = key % self.keys[-1]
+            else:
+                key = np.where(np.asarray(key) > self.keys[-1], np.mod(key, self.keys[-1]), key)
         return np.interp(key, self.keys, self.values)
 
+    def compile(self, size):
+        """Interpolate the integer keys below size once into a dense table, looked up instead of interpolating."""
+        if size > len(self.table):
+            self.table = self.interpolate(np.arange(size))
+        return self
+
     def __mul__(self, value):
-        return LinearInterpolator(dict(zip(self.keys, (v * value for v in self.values))))
+        return LinearInterpolator(dict(zip(self.keys, (v * value for v in self.values))), self.mod)
 
     __rmul__ = __mul__
 
@@ -62,18 +88,21 @@ class WeightedDictionary:
        value = wdict[0.05] # value == value1
        value = wdict[0.3] # value == value2
        value = wdict[0.5] # value == value3
+       indices = wdict.sample(np.array([0.05, 0.5])) # indices == [0, 2]
     '''
 
     def __init__(self, dictionary):
         self.dictionary = {k: v for k, v in sorted(dictionary.items(), key=lambda item: item[1])}
+        self.keys = list(self.dictionary.keys())
+        self.thresholds = list(self.dictionary.values())
+        self.thresholds_array = np.array(self.thresholds, dtype=float)
 
     def __getitem__(self, p):
-        for key, value in self.dictionary.items():
-            if p < value:
-                return key
-            else:
-                last_key = key
-        return last_key
+        return self.keys[min(bisect.bisect_right(self.thresholds, p), len(self.keys) - 1)]
+
+    def sample(self, u):
+        """Return the indices in keys of the values selected by each probability of the array u."""
+        return np.minimum(np.searchsorted(self.thresholds_array, u, side='right'), len(self.keys) - 1)
 
 class PurchaseOptions:
     """A purchase options class."""
@@ -85,14 +114,23 @@ class PurchaseOptions:
         self.spend_time_per_session_sigma = spend_time_per_session_sigma
         self.spend_per_visit_ratio = spend_per_visit_ratio
 
-    def amount(self):
-        return int(max(0, random.gauss(self.amount_per_spend, self.amount_per_spend_sigma)))
+    def sample_amount(self, n, rng=np.random):
+        return sample_count(self.amount_per_spend, self.amount_per_spend_sigma, n, rng)
+
+    def sample_spend_count(self, n, rng=np.random):
+        return sample_count(self.spend_time_per_session, self.spend_time_per_session_sigma, n, rng)
+
+    def sample_must_spend(self, n, rng=np.random):
+        return rng.random(n) < self.spend_per_visit_ratio
 
-    def spend_count(self):
-        return int(max(0, random.gauss(self.spend_time_per_session, self.spend_time_per_session_sigma)))
+    def amount(self, rng=np.random):
+        return int(self.sample_amount(1, rng)[0])
 
-    def must_spend(self):
-        return random.random() < self.spend_per_visit_ratio
+    def spend_count(self, rng=np.random):
+        return int(self.sample_spend_count(1, rng)[0])
+
+    def must_spend(self, rng=np.random):
+        return bool(self.sample_must_spend(1, rng)[0])
 
 class StageOptions:
     """A stage options class."""
@@ -104,14 +142,25 @@ class StageOptions:
         self.score_mu = score_mu
         self.score_sigma = score_sigma
 
-    def duration(self, factor=2):
-        return random_duration_clamp(self.duration_mu, self.duration_sigma, factor)
+    def sample_duration(self, n, rng=np.random, *, factor=2):
+        """Return n stage durations in seconds."""
+        return sample_gauss_clamp(self.duration_mu.total_seconds(), self.duration_sigma.total_seconds(), factor, n, rng)
+
+    def sample_interval_duration(self, n, rng=np.random, *, factor=2):
+        """Return n durations in seconds between two stages."""
+        return self.duration_ratio * self.sample_duration(n, rng, factor=factor)
+
+    def sample_score(self, n, rng=np.random):
+        return sample_count(self.score_mu, self.score_sigma, n, rng)
+
+    def duration(self, rng=np.random, *, factor=2):
+        return timedelta(seconds=float(self.sample_duration(1, rng, factor=factor)[0]))
 
-    def interval_duration(self, factor=2):
-        return self.duration_ratio * random_duration_clamp(self.duration_mu, self.duration_sigma, factor)
+    def interval_duration(self, rng=np.random, *, factor=2):
+        return timedelta(seconds=float(self.sample_interval_duration(1, rng, factor=factor)[0]))
 
-    def score(self):
-        return int(max(0, random.gauss(self.score_mu, self.score_sigma)))
+    def score(self, rng=np.random):
+        return int(self.sample_score(1, rng)[0])
             
 class SessionOptions:
     """A session options class."""
@@ -122,11 +171,19 @@ class SessionOptions:
         self.duration_mu = duration_mu
         self.duration_sigma = duration_sigma
 
-    def time(self):
-        return random_time(self.time_mu, self.time_sigma)
+    def sample_time(self, n, rng=np.random):
+        """Return n sessions start times in seconds since midnight."""
+        return sample_gauss(self.time_mu.total_seconds(), self.time_sigma.total_seconds(), n, rng)
+
+    def sample_duration(self, n, rng=np.random, *, factor=3):
+        """Return n sessions durations in seconds."""
+        return sample_gauss_clamp(self.duration_mu.total_seconds(), self.duration_sigma.total_seconds(), factor, n, rng)
+
+    def time(self, rng=np.random):
+        return timedelta(seconds=float(self.sample_time(1, rng)[0]))
     
-    def duration(self, factor=3):
-        return random_duration_clamp(self.duration_mu, self.duration_sigma, factor)
+    def duration(self, rng=np.random, *, factor=3):
+        return timedelta(seconds=float(self.sample_duration(1, rng, factor=factor)[0]))
 
 class PlayerOptions:
     """A player options class."""   
@@ -153,6 +210,21 @@ class GameOptions:
         self.players_acquisition = players_acquisition
         self.simulation_days = simulation_days
 
+    def compile(self):
+        """Compile the players lifetimes into dense tables covering the simulation days."""
+        for players_options in self.players_options:
+            for player_options in players_options.keys:
+                player_options.lifetime.compile(self.simulation_days)
+        return self
+
+    def player_types(self):
+        """Return the player types of the players options, in order of appearance."""
+        return list(dict.fromkeys(
+            player_options.player_type
+            for players_options in self.players_options
+            for player_options in players_options.keys
+        ))
+
 def default_game_options(players, days, players_options_days, players_acquisition_days, players_options_presets, players_acquisition_presets):
 
     # sessions options
@@ -0,0 +1,388 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+import json
+import shutil
+from os.path import exists
+from enum import Enum, auto
+import numpy as np
+import pandas as pd
+from pbdg.common import PlayerEventField
+
+
+class StorageFormat(Enum):
+    csv = auto()
+    parquet = auto()
+    arrow = auto()
+
+    @classmethod
+    def names(cls):
+        return list(map(lambda e: e.name, cls))
+
+
+class IdFormat(Enum):
+    int = auto()
+    hex = auto()
+    uuid = auto()
+
+    @classmethod
+    def names(cls):
+        return list(map(lambda e: e.name, cls))
+
+
+PARTITION_FIELD = 'date'
+
+# the csv timestamps are written with a single format, so they are parsed back without format inference
+CSV_DATE_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+ID_FIELDS = [
+    PlayerEventField.id.name,
+    PlayerEventField.cohort_id.name,
+    PlayerEventField.player_id.name,
+    PlayerEventField.session_id.name,
+    PlayerEventField.stage_id.name,
+]
+
+UUID_GROUPS = [(0, 8), (8, 12), (12, 16), (16, 20), (20, 32)]
+
+DICTIONARY_FIELDS = [
+    PlayerEventField.platform_type.name,
+    PlayerEventField.player_type.name,
+    PlayerEventField.event_type.name,
+]
+
+CSV_DTYPES = {
+    **{name: 'category' for name in DICTIONARY_FIELDS},
+    PlayerEventField.stage_id.name: str,
+    PlayerEventField.stage_score.name: 'Int32',
+}
+
+
+def import_pyarrow():
+    """Import pyarrow on demand, it is only required by the parquet and arrow formats."""
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.dataset
+        import pyarrow.feather
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError(
+            'the parquet and arrow formats require pyarrow, '
+            'install it with: pip install players-behaviors-dataset-generator[arrow]'
+        ) from None
+    return pyarrow
+
+
+def ids_salt(seed, field):
+    """Return the 64-bit salt of an ids field, derived from the seed, with the uuid version 4 bits set."""
+    salt = int(np.random.SeedSequence([seed, ID_FIELDS.index(field)]).generate_state(1, dtype=np.uint64)[0])
+    return salt & ~0xf000 | 0x4000
+
+
+def render_ids(ids, id_format, salt):
+    """Render 64-bit ids as 128-bit values, the salt being the high half, in hex or uuid format.
+
+    The ids being below 2**62, the variant bits of the low half are set without losing the ids, so the uuids are valid
+    version 4 uuids which can be turned back into the ids.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    values = np.empty((len(ids), 2), dtype='>u8')
+    values[:, 0] = salt
+    values[:, 1] = ids.astype(np.uint64) | np.uint64(1 << 63)
+    chars = np.frombuffer(values.tobytes().hex().encode(), dtype='S1').reshape(len(ids), 32)
+    if id_format == IdFormat.hex.name:
+        return np.frombuffer(chars.tobytes(), dtype='S32').astype(str)
+
+    uuids = np.full((len(ids), 36), b'-', dtype='S1')
+    for group, (begin, end) in enumerate(UUID_GROUPS):
+        uuids[:, begin + group:end + group] = chars[:, begin:end]
+    return np.frombuffer(uuids.tobytes(), dtype='S36').astype(str)
+
+
+def storage_path(filename, storage_format):
+    return f'{filename}.{storage_format}'
+
+
+def remove_path(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif exists(path):
+        os.remove(path)
+
+
+class EventsWriter:
+    """Write time sorted events DataFrames one after the other, their 64-bit ids being rendered in the ids format.
+
+    The csv format writes a single file, the parquet and arrow formats write a dataset partitioned by event date
+    (<filename>.<format>/date=YYYY-MM-DD/part-NNNNN.<format>) with typed timestamps and dictionary encoded enums.
+    """
+
+    def __init__(self, filename, storage_format, id_format=IdFormat.int.name, seed=0):
+        self.storage_format = storage_format
+        self.id_format = id_format
+        self.salts = {field: ids_salt(seed, field) for field in ID_FIELDS}
+        self.path = storage_path(filename, storage_format)
+        self.rows = 0
+        self.header = True
+        self.schema = None
+        self.partition = None
+        self.parts = dict()
+        self.writer = None
+        self.tables = []
+
+        if storage_format != StorageFormat.csv.name:
+            self.pa = import_pyarrow()
+        remove_path(self.path)
+        if storage_format != StorageFormat.csv.name:
+            os.makedirs(self.path)
+
+    def render(self, dataframe):
+        if self.id_format == IdFormat.int.name:
+            return dataframe
+        dataframe = dataframe.copy()
+        for field in ID_FIELDS:
+            if field in dataframe:
+                ids = dataframe[field].to_numpy()
+                present = pd.notna(ids)
+                rendered = np.full(len(ids), None, dtype=object)
+                rendered[present] = render_ids(ids[present], self.id_format, self.salts[field])
+                dataframe[field] = rendered
+        return dataframe
+
+    def write(self, dataframe):
+        dataframe = self.render(dataframe)
+        if self.storage_format == StorageFormat.csv.name:
+            dataframe.to_csv(self.path, mode='w' if self.header else 'a', header=self.header, index=False,
+                             date_format=CSV_DATE_FORMAT)
+            self.header = False
+            self.rows += len(dataframe)
+            return
+
+        if len(dataframe) == 0:
+            return
+        self.rows += len(dataframe)
+
+        # the events are sorted by time, so each date is a contiguous slice
+        dates = dataframe[PlayerEventField.timestamp.name].to_numpy().astype('datetime64[D]')
+        bounds = np.concatenate(([0], np.flatnonzero(dates[1:] != dates[:-1]) + 1, [len(dates)]))
+        for begin, end in zip(bounds[:-1], bounds[1:]):
+            self.write_partition(str(dates[begin]), dataframe.iloc[begin:end])
+
+    def to_table(self, dataframe):
+        pa = self.pa
+        table = pa.Table.from_pandas(dataframe, preserve_index=False)
+        if self.id_format != IdFormat.int.name:
+            # the rendered ids are strings, even in a batch where an ids field only has missing values
+            for name in ID_FIELDS:
+                if name in table.column_names:
+                    index = table.column_names.index(name)
+                    table = table.set_column(index, name, table[name].cast(pa.string()))
+        for name in DICTIONARY_FIELDS:
+            if name in table.column_names and not pa.types.is_dictionary(table.schema.field(name).type):
+                index = table.column_names.index(name)
+                table = table.set_column(index, name, pa.compute.dictionary_encode(table[name]))
+        if self.schema is None:
+            self.schema = table.schema
+        return table.cast(self.schema)
+
+    def write_partition(self, partition, dataframe):
+        table = self.to_table(dataframe)
+        if partition != self.partition:
+            self.close_partition()
+            directory = os.path.join(self.path, f'{PARTITION_FIELD}={partition}')
+            os.makedirs(directory, exist_ok=True)
+            part = self.parts.get(partition, 0)
+            self.parts[partition] = part + 1
+            path = os.path.join(directory, f'part-{part:05d}.{self.storage_format}')
+            if self.storage_format == StorageFormat.parquet.name:
+                self.writer = self.pa.parquet.ParquetWriter(path, self.schema)
+            else:
+                self.writer = path
+            self.partition = partition
+
+        if self.storage_format == StorageFormat.parquet.name:
+            self.writer.write_table(table)
+        else:
+            self.tables.append(table)
+
+    def close_partition(self):
+        if self.writer is None:
+            return
+        if self.storage_format == StorageFormat.parquet.name:
+            self.writer.close()
+        else:
+            # an arrow file holds a single dictionary per column, the batches of the partition share a unified one
+            table = self.pa.concat_tables(self.tables).unify_dictionaries()
+            with self.pa.ipc.new_file(self.writer, table.schema) as writer:
+                writer.write_table(table)
+            self.tables = []
+        self.writer = None
+        self.partition = None
+
+    def close(self):
+        self.close_partition()
+
+
+def parse_timestamps(timestamps):
+    try:
+        return pd.to_datetime(timestamps, format=CSV_DATE_FORMAT)
+    except ValueError:
+        # events files written before the timestamps had a single format
+        return pd.to_datetime(timestamps, format='ISO8601')
+
+
+def parse_ids(ids):
+    """Parse ids read as strings, nullable 64-bit integer ids being parsed back into integers without precision loss."""
+    try:
+        return pd.to_numeric(ids, dtype_backend='numpy_nullable')
+    except (ValueError, TypeError):
+        # hex or uuid ids
+        return ids
+
+
+def read_events(filename, storage_format, columns=None):
+    """Read events written by an EventsWriter, only loading the given columns, with parsed timestamps and categorical enums."""
+    path = storage_path(filename, storage_format)
+
+    if storage_format == StorageFormat.csv.name:
+        return parse_csv_events(pd.read_csv(path, usecols=columns, dtype=CSV_DTYPES), columns)
+
+    dataset, columns = events_dataset(path, storage_format, columns)
+    if len(dataset.files) == 0:
+        return pd.DataFrame(columns=columns)
+    return dataset.to_table(columns=columns).to_pandas()
+
+
+def read_events_batches(filename, storage_format, columns=None, batch_rows=1000000):
+    """Read events written by an EventsWriter as DataFrames of at most batch_rows events, in the file order."""
+    path = storage_path(filename, storage_format)
+
+    if storage_format == StorageFormat.csv.name:
+        for dataframe in pd.read_csv(path, usecols=columns, dtype=CSV_DTYPES, chunksize=batch_rows):
+            yield parse_csv_events(dataframe, columns)
+        return
+
+    dataset, columns = events_dataset(path, storage_format, columns)
+    for batch in dataset.to_batches(columns=columns, batch_size=batch_rows):
+        if batch.num_rows > 0:
+            yield batch.to_pandas()
+
+
+def count_events(filename, storage_format):
+    """Count the events of a file without loading them, from the datasets metadata or the csv lines."""
+    path = storage_path(filename, storage_format)
+
+    if storage_format == StorageFormat.csv.name:
+        lines = 0
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 24), b''):
+                lines += block.count(b'\n')
+        return max(lines - 1, 0)
+
+    dataset, _ = events_dataset(path, storage_format)
+    return dataset.count_rows()
+
+
+def parse_csv_events(dataframe, columns):
+    if PlayerEventField.stage_id.name in dataframe:
+        dataframe[PlayerEventField.stage_id.name] = parse_ids(dataframe[PlayerEventField.stage_id.name])
+    if PlayerEventField.timestamp.name in dataframe:
+        dataframe[PlayerEventField.timestamp.name] = parse_timestamps(dataframe[PlayerEventField.timestamp.name])
+    return dataframe if columns is None else dataframe[columns]
+
+
+def events_dataset(path, storage_format, columns=None):
+    pa = import_pyarrow()
+    dataset = pa.dataset.dataset(
+        path, format='parquet' if storage_format == StorageFormat.parquet.name else 'ipc', partitioning='hive')
+    if columns is None:
+        columns = [name for name in dataset.schema.names if name != PARTITION_FIELD]
+    return dataset, columns
+
+
+def write_features(dataframe, filename, storage_format):
+    """Write the features DataFrame, its index being stored as a column."""
+    path = storage_path(filename, storage_format)
+    if storage_format == StorageFormat.csv.name:
+        dataframe.to_csv(path)
+        return
+
+    pa = import_pyarrow()
+    table = pa.Table.from_pandas(dataframe, preserve_index=True)
+    if storage_format == StorageFormat.parquet.name:
+        pa.parquet.write_table(table, path)
+    else:
+        pa.feather.write_feather(table, path)
+
+
+def sparse_features_paths(filename):
+    return f'{filename}.npz', f'{filename}.columns.json'
+
+
+def write_sparse_features(dataframe, filename):
+    """Write the features DataFrame as a CSR matrix .npz file, with a json manifest of its columns.
+
+    The .npz file holds the data, indices, indptr, shape and format arrays of a float64 CSR matrix, the layout read by
+    scipy.sparse.load_npz, the zeros being left out. The rows are in the DataFrame order.
+
+    The matrix is built column by column without a dense float64 copy of the features: a first pass counts the
+    nonzeros of each row, and a second one puts the nonzeros of each column after the previous ones of their row.
+    """
+    matrix_path, manifest_path = sparse_features_paths(filename)
+    counts = np.zeros(len(dataframe), dtype=np.int64)
+    for _, values in dataframe.items():
+        counts += values.to_numpy() != 0
+    indptr = np.concatenate(([0], np.cumsum(counts)))
+    data = np.empty(indptr[-1], dtype=np.float64)
+    indices = np.empty(indptr[-1], dtype=np.int32)
+    cursors = indptr[:-1].copy()
+    for column, (_, values) in enumerate(dataframe.items()):
+        values = values.to_numpy()
+        rows = np.flatnonzero(values)
+        data[cursors[rows]] = values[rows]
+        indices[cursors[rows]] = column
+        cursors[rows] += 1
+    with open(matrix_path, 'wb') as file:
+        np.savez(file, data=data, indices=indices, indptr=indptr, shape=np.array(dataframe.shape), format=np.array(b'csr'))
+    with open(manifest_path, 'w') as file:
+        json.dump({'format': 'csr', 'shape': list(dataframe.shape), 'columns': list(dataframe.columns)}, file, indent=2)
+
+
+class FeaturesWriter:
+    """Write features DataFrames one after the other in a single file, their index being stored as a column."""
+
+    def __init__(self, filename, storage_format):
+        self.storage_format = storage_format
+        self.path = storage_path(filename, storage_format)
+        self.rows = 0
+        self.header = True
+        self.schema = None
+        self.writer = None
+
+        if storage_format != StorageFormat.csv.name:
+            self.pa = import_pyarrow()
+        remove_path(self.path)
+
+    def write(self, dataframe):
+        self.rows += len(dataframe)
+        if self.storage_format == StorageFormat.csv.name:
+            dataframe.to_csv(self.path, mode='w' if self.header else 'a', header=self.header)
+            self.header = False
+            return
+
+        table = self.pa.Table.from_pandas(dataframe, preserve_index=True)
+        if self.schema is None:
+            self.schema = table.schema
+            if self.storage_format == StorageFormat.parquet.name:
+                self.writer = self.pa.parquet.ParquetWriter(self.path, self.schema)
+            else:
+                self.writer = self.pa.ipc.new_file(self.path, self.schema)
+        self.writer.write_table(table.cast(self.schema))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
@@ -0,0 +1,31 @@
+import pandas as pd
+import pytest
+from click.testing import CliRunner
+
+from pbdg.main import main
+
+# a tiny seeded dataset, every path of a command is run on it and their outputs compared
+EVENTS_DATE = '2024-01-01'
+EVENTS_PLAYERS = 50
+EVENTS_DAYS = 5
+EVENTS_SEED = 7
+
+
+def run(*args):
+    """Run a pbdg command and return its output, failing the test when the command fails."""
+    result = CliRunner().invoke(main, [str(arg) for arg in args], catch_exceptions=False)
+    assert result.exit_code == 0, result.output
+    return result.output
+
+
+def read_features(path):
+    return pd.read_csv(f'{path}.csv', index_col=0)
+
+
+@pytest.fixture(scope='session')
+def events(tmp_path_factory):
+    """The filename of the events of the tiny dataset, in csv."""
+    events = tmp_path_factory.mktemp('events') / 'events'
+    run('events', events, '--date', EVENTS_DATE, '--players', EVENTS_PLAYERS, '--days', EVENTS_DAYS,
+        '--seed', EVENTS_SEED, '--engine', 'vectorized')
+    return events
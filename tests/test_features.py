@@ -0,0 +1,54 @@
+import pandas as pd
+import pytest
+
+from conftest import EVENTS_DATE, EVENTS_DAYS, read_features, run
+
+# the serial time of day features are timedeltas truncated to the microsecond, the vectorized ones float seconds, and
+# the csv values are rounded to the microsecond
+TIME_OF_DAY_ATOL = 2e-6
+
+
+def split_events(events, path, date):
+    """Write the events before date and the events from date in two csv files, and return their filenames."""
+    header, *lines = open(f'{events}.csv').read().splitlines(keepends=True)
+    timestamp = header.split(',').index('timestamp')
+    before, after = path / 'before', path / 'after'
+    with open(f'{before}.csv', 'w') as file:
+        file.writelines([header] + [line for line in lines if line.split(',')[timestamp] < date])
+    with open(f'{after}.csv', 'w') as file:
+        file.writelines([header] + [line for line in lines if line.split(',')[timestamp] >= date])
+    return before, after
+
+
+@pytest.mark.parametrize('options', [[], ['--last-minutes', 60, '--last-hours', 24]])
+def test_vectorized_features_match_serial(events, tmp_path, options):
+    for engine in ['serial', 'vectorized']:
+        run('features', tmp_path / engine, '--events', events, '--engine', engine, *options)
+    serial = read_features(tmp_path / 'serial')
+    vectorized = read_features(tmp_path / 'vectorized')
+
+    assert len(serial) > 0
+    pd.testing.assert_frame_equal(vectorized, serial, check_exact=False, rtol=0, atol=TIME_OF_DAY_ATOL)
+
+
+@pytest.mark.parametrize('engine', ['serial', 'vectorized'])
+def test_workers_features_are_identical(events, tmp_path, engine):
+    run('features', tmp_path / 'single', '--events', events, '--engine', engine)
+    for workers in [2, 3]:
+        run('features', tmp_path / f'workers{workers}', '--events', events, '--engine', engine, '--workers', workers)
+        assert (tmp_path / f'workers{workers}.csv').read_bytes() == (tmp_path / 'single.csv').read_bytes()
+
+
+@pytest.mark.parametrize('engine', ['serial', 'vectorized'])
+def test_state_update_matches_recompute(events, tmp_path, engine):
+    date = (pd.Timestamp(EVENTS_DATE) + pd.Timedelta(days=EVENTS_DAYS - 2)).strftime('%Y-%m-%d')
+    before, after = split_events(events, tmp_path, date)
+    state = tmp_path / 'state.npz'
+    run('features', tmp_path / 'built', '--events', before, '--engine', engine, '--state', state)
+    run('features', tmp_path / 'updated', '--events', after, '--engine', engine, '--state', state)
+    run('features', tmp_path / 'recomputed', '--events', events, '--engine', engine)
+    updated = read_features(tmp_path / 'updated')
+    recomputed = read_features(tmp_path / 'recomputed')
+
+    assert 0 < len(read_features(tmp_path / 'built')) < len(recomputed)
+    pd.testing.assert_frame_equal(updated, recomputed, check_exact=False, rtol=0, atol=TIME_OF_DAY_ATOL)
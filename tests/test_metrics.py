@@ -0,0 +1,36 @@
+import pandas as pd
+import pytest
+
+from conftest import run
+
+METRICS_FILES = ['daily', 'cohorts', 'ccu']
+
+
+@pytest.fixture(scope='module')
+def metrics(events, tmp_path_factory):
+    """The filename of the metrics of the tiny dataset, aggregated in a single chunk."""
+    metrics = tmp_path_factory.mktemp('metrics') / 'metrics'
+    run('metrics', metrics, '--events', events, '--ccu')
+    return metrics
+
+
+@pytest.mark.parametrize('chunk_size', [7, 100])
+def test_chunked_metrics_are_identical(events, metrics, tmp_path, chunk_size):
+    chunked = tmp_path / 'chunked'
+    run('metrics', chunked, '--events', events, '--ccu', '--chunk-size', chunk_size)
+    for name in METRICS_FILES:
+        with open(f'{chunked}_{name}.csv', 'rb') as chunked_file, open(f'{metrics}_{name}.csv', 'rb') as file:
+            assert chunked_file.read() == file.read()
+
+
+def test_daily_metrics_match_events(events, metrics):
+    game_events = pd.read_csv(f'{events}.csv', parse_dates=['timestamp'])
+    game_events['date'] = game_events['timestamp'].dt.strftime('%Y-%m-%d')
+    daily = pd.read_csv(f'{metrics}_daily.csv', index_col=['date', 'platform_type']).xs('ALL', level='platform_type')
+
+    transactions = game_events[game_events['event_type'] == 'IAP_TRANSACTION']
+    pd.testing.assert_series_equal(
+        daily['active_players'], game_events.groupby('date')['player_id'].nunique(), check_names=False)
+    pd.testing.assert_series_equal(
+        daily['revenue'], transactions.groupby('date')['item_value'].sum().reindex(daily.index, fill_value=0.0),
+        check_names=False)